@@ -0,0 +1,195 @@
+#!/usr/bin/python -u
+# -*- coding: utf-8 -*-
+
+# Clock used by the start/stop instances for the runtime and timer
+# arithmetic. It is created by the Generator and handed to every instance,
+# so it can be replaced by one that is not tied to the system time.
+# read() gives a ClockReading, the time of an evaluation cycle. Each clock
+# has the local timezone, LocalZone, and caches the local date between
+# midnights for its readings, LocalDays.
+
+import calendar
+import datetime
+import math
+import os
+import time
+import monotonic_time
+
+# Ordinal of 1970-01-01
+EPOCH_ORDINAL = 719163
+
+def _utcoffset(t):
+	# Offset of the local time to UTC in seconds, from libc
+	t = int(math.floor(t))
+	return calendar.timegm(time.localtime(t)) - t
+
+class LocalZone(object):
+	""" The local timezone. set() applies it to the process, the UTC offset
+	is then cached with the period it holds, between two DST transitions,
+	so local time arithmetic needs no libc calls till the next transition.
+	The transitions are searched for a year around the time, in weeks and
+	then to the second. """
+	__slots__ = ('name', 'offset', 'validfrom', 'validuntil')
+	SEARCH_STEP = 7 * 86400
+	SEARCH_STEPS = 53
+
+	def __init__(self):
+		self.name = None
+		self._invalidate()
+
+	def _invalidate(self):
+		self.offset = None
+		self.validfrom = float('inf')
+		self.validuntil = float('-inf')
+
+	def set(self, name):
+		# name is a tz database name like Europe/Amsterdam, None for UTC
+		name = name if name else 'UTC'
+		if name == self.name:
+			return False
+		self.name = name
+		os.environ['TZ'] = name
+		time.tzset()
+		self._invalidate()
+		return True
+
+	def _transition(self, t, offset, direction):
+		# First time from t, in direction, with another offset
+		t = int(math.floor(t))
+		inside = t
+		for i in range(1, self.SEARCH_STEPS + 1):
+			outside = t + direction * i * self.SEARCH_STEP
+			if _utcoffset(outside) != offset:
+				break
+			inside = outside
+		else:
+			# None within the search, look again from there
+			return outside + (1 if direction > 0 else 0)
+		while abs(outside - inside) > 1:
+			middle = (inside + outside) // 2
+			if _utcoffset(middle) == offset:
+				inside = middle
+			else:
+				outside = middle
+		# validuntil is the first time outside, validfrom the first inside
+		return outside if direction > 0 else inside
+
+	def utcoffset(self, t):
+		if not self.validfrom <= t < self.validuntil:
+			self.offset = _utcoffset(t)
+			self.validuntil = self._transition(t, self.offset, 1)
+			self.validfrom = self._transition(t, self.offset, -1)
+		return self.offset
+
+	def to_utc(self, local):
+		# Wall time of local seconds since epoch. Local times skipped or
+		# repeated by a DST transition resolve like mktime might.
+		t = local - self.offset
+		if self.validfrom <= t < self.validuntil:
+			return t
+		return local - _utcoffset(t)
+
+	def day(self, t):
+		# Days since epoch of the local date
+		return int((t + self.utcoffset(t)) // 86400)
+
+	def midnight(self, day):
+		# Wall time of the start of a local day
+		return self.to_utc(day * 86400)
+
+class LocalDays(object):
+	""" Local date of a wall time, computed again only when the time is
+	outside the day it holds, so at the first time after midnight. The
+	zone provides the UTC offsets, a timezone change needs a reset(). """
+	__slots__ = ('zone', 'today', 'midnight', 'nextmidnight', 'day')
+
+	def __init__(self, zone):
+		self.zone = zone
+		self.reset()
+
+	def reset(self):
+		self.today = None
+		self.midnight = float('inf')
+		self.nextmidnight = float('-inf')
+		self.day = None
+
+	def update(self, t):
+		if self.midnight <= t < self.nextmidnight:
+			return
+		# Days since epoch of the local date, its date and the wall time of
+		# its start
+		self.day = self.zone.day(t)
+		self.today = datetime.date.fromordinal(EPOCH_ORDINAL + self.day)
+		self.midnight = self.zone.midnight(self.day)
+		self.nextmidnight = self.zone.midnight(self.day + 1)
+
+class ClockReading(object):
+	""" The clock at one moment, with the calendar values derived from it.
+	Everything evaluated in a cycle uses the same reading, so all of it
+	sees the same time and date. """
+	__slots__ = ('zone', 'time', 'monotonic', 'today', 'midnight', 'nextmidnight', 'day')
+
+	def __init__(self, clock):
+		self.time = clock.time()
+		self.monotonic = clock.monotonic()
+		days = clock.days
+		days.update(self.time)
+		self.zone = days.zone
+		self.today = days.today
+		self.midnight = days.midnight
+		self.nextmidnight = days.nextmidnight
+		self.day = days.day
+
+	@property
+	def seconds_since_midnight(self):
+		return self.time - self.midnight
+
+	def local_midnight(self, date):
+		# Wall time of the start of another local date, DST aware
+		if date == self.today:
+			return self.midnight
+		return self.zone.midnight(date.toordinal() - EPOCH_ORDINAL)
+
+class SystemClock:
+	def __init__(self, zone=None):
+		# Implementations are resolved once, calling them allocates nothing
+		self.monotonic = monotonic_time.get_monotonic_seconds_impl()
+		self.time = time.time
+		self.zone = zone or LocalZone()
+		self.days = LocalDays(self.zone)
+
+	def read(self):
+		return ClockReading(self)
+
+	def set_timezone(self, name):
+		if self.zone.set(name):
+			self.days.reset()
+
+class VirtualClock:
+	""" Clock that only moves when told to, for replays and tests. Wall and
+	monotonic time move together, starting at the given wall time. """
+	def __init__(self, start, zone=None):
+		self._time = start
+		self._start = start
+		self.zone = zone or LocalZone()
+		self.days = LocalDays(self.zone)
+
+	def time(self):
+		return self._time
+
+	def monotonic(self):
+		return self._time - self._start
+
+	def set_time(self, t):
+		# Never goes back
+		self._time = max(self._time, t)
+
+	def advance(self, seconds):
+		self.set_time(self._time + seconds)
+
+	def read(self):
+		return ClockReading(self)
+
+	def set_timezone(self, name):
+		if self.zone.set(name):
+			self.days.reset()
@@ -0,0 +1,264 @@
+#!/usr/bin/python -u
+# -*- coding: utf-8 -*-
+
+# Start/stop conditions
+# Each condition is a class added to the registry with @register, declaring
+# the inputs it reads, its settings and how its value is compared with them.
+# StartStop creates one object of every registered condition and evaluates
+# them in the order they were registered, so a new condition only needs a
+# new class here.
+
+# Per phase paths
+phases = ('L1', 'L2', 'L3')
+acout_paths = tuple('/Ac/Out/%s/P' % phase for phase in phases)
+consumption_paths = tuple('/Ac/Consumption/%s/Power' % phase for phase in phases)
+hightemp_paths = tuple('/Alarms/%s/HighTemperature' % phase for phase in phases)
+overload_paths = tuple('/Alarms/%s/Overload' % phase for phase in phases)
+
+# Per phase measurements aggregated by the Generator, see PhaseAggregates:
+# name, service ('vebus' or 'system') and paths
+phase_measurements = (
+	('acout', 'vebus', acout_paths),
+	('consumption', 'system', consumption_paths),
+	('hightemp', 'vebus', hightemp_paths),
+	('overload', 'vebus', overload_paths))
+
+registry = []
+
+def register(cls):
+	registry.append(cls)
+	return cls
+
+def get_settingsbase():
+	# Settings of all the registered conditions
+	settingsbase = {}
+	for cls in registry:
+		settingsbase.update(cls.settingsbase)
+	return settingsbase
+
+def get_measurements(selected):
+	# Per phase measurements read by the selected conditions
+	measurements = set()
+	for condition in selected:
+		measurements.update(condition.measurements)
+	return measurements
+
+def get_inputs(source, selected=None):
+	# Paths read from the 'battery', 'vebus' or 'system' service by the
+	# selected conditions, all the registered ones by default
+	paths = []
+	for condition in registry if selected is None else selected:
+		for s, path in condition.inputs:
+			if s == source and path not in paths:
+				paths.append(path)
+	return tuple(paths)
+
+class ConditionSettings(object):
+	# Settings of a condition, bound to the instance settings so they are
+	# kept up to date. Boolean conditions have no start/stop values and
+	# only timed conditions have timers.
+	__slots__ = ('enabled', 'start', 'stop', 'qh_start', 'qh_stop', 'starttimer', 'stoptimer')
+
+class Condition(object):
+	# State of the condition, the declaration is done by the class attributes
+	__slots__ = ('settings', 'reached', 'start_timer', 'stop_timer', 'valid', 'enabled', 'retries')
+
+	name = None
+	# Service that must be available to evaluate it, 'battery' or 'vebus'
+	monitoring = None
+	# (service, path) read by value(), service being 'battery', 'vebus' or 'system'
+	inputs = ()
+	# Per phase measurements read by value(), see phase_measurements
+	measurements = ()
+	# Boolean conditions are reached at 1 and released at 0, the others
+	# compare the value with the start/stop settings
+	boolean = False
+	# Timed conditions must be reached/released during the start/stop timer
+	timed = True
+	# A reached inhibit condition keeps the generator stopped, unless it is
+	# started manually or by the test run
+	inhibit = False
+	# Settings, in the format used by the Generator settings
+	settingsbase = {}
+
+	def __init__(self):
+		self.settings = ConditionSettings()
+		self.reached = False
+		# True when the timer elapsed
+		self.start_timer = False
+		self.stop_timer = False
+		self.valid = True
+		self.enabled = False
+		self.retries = 0
+
+	def value(self, startstop, get_value):
+		# Current value of the condition, None if it is not available.
+		# startstop is the instance evaluating it, giving the services in use.
+		raise Exception('This function should be overridden')
+
+@register
+class SocCondition(Condition):
+	__slots__ = ()
+	name = 'soc'
+	monitoring = 'battery'
+	inputs = (('battery', '/Soc'),)
+	timed = False
+	settingsbase = {
+		'socenabled': ['/Settings/{0}/Soc/Enabled', 0, 0, 1],
+		'socstart': ['/Settings/{0}/Soc/StartValue', 80, 0, 100],
+		'socstop': ['/Settings/{0}/Soc/StopValue', 90, 0, 100],
+		'qh_socstart': ['/Settings/{0}/Soc/QuietHoursStartValue', 90, 0, 100],
+		'qh_socstop': ['/Settings/{0}/Soc/QuietHoursStopValue', 90, 0, 100]
+		}
+
+	def value(self, startstop, get_value):
+		return get_value(startstop._battery_service or '', '/Soc')
+
+@register
+class AcLoadCondition(Condition):
+	__slots__ = ()
+	name = 'acload'
+	monitoring = 'vebus'
+	inputs = (tuple(('vebus', path) for path in acout_paths) +
+			tuple(('system', path) for path in consumption_paths))
+	measurements = ('acout', 'consumption')
+	settingsbase = {
+		'acloadenabled': ['/Settings/{0}/AcLoad/Enabled', 0, 0, 1],
+		# Measuerement, 0 = Total AC consumption, 1 = AC on inverter output, 2 = Single phase
+		'acloadmeasuerment': ['/Settings/{0}/AcLoad/Measurement', 0, 0, 100],
+		'acloadstart': ['/Settings/{0}/AcLoad/StartValue', 1600, 5, 100000],
+		'acloadstop': ['/Settings/{0}/AcLoad/StopValue', 800, 0, 100000],
+		'acloadstarttimer': ['/Settings/{0}/AcLoad/StartTimer', 20, 0, 10000],
+		'acloadstoptimer': ['/Settings/{0}/AcLoad/StopTimer', 20, 0, 10000],
+		'qh_acloadstart': ['/Settings/{0}/AcLoad/QuietHoursStartValue', 1900, 0, 100000],
+		'qh_acloadstop': ['/Settings/{0}/AcLoad/QuietHoursStopValue', 1200, 0, 100000]
+		}
+
+	def value(self, startstop, get_value):
+		# The sums and maximum of the phases are kept by the Generator
+		loadOnAcOut = startstop._phases.get(startstop._vebusservice, 'acout')
+
+		# Invalidate if vebus is not available
+		if loadOnAcOut is None or loadOnAcOut.values[0] == None:
+			return None
+
+		measurement = startstop._settings.acloadmeasuerment
+		# Toltal consumption
+		if measurement == 0:
+			consumption = startstop._phases.get(startstop._system_service, 'consumption')
+			return consumption.sum if consumption is not None else 0
+		# Load on inverter AC out
+		if measurement == 1:
+			return loadOnAcOut.sum
+		# Highest phase load
+		if measurement == 2:
+			return loadOnAcOut.max
+		return None
+
+@register
+class BatteryCurrentCondition(Condition):
+	__slots__ = ()
+	name = 'batterycurrent'
+	monitoring = 'battery'
+	inputs = (('battery', '/Dc/0/Current'), ('battery', '/Dc/1/Current'))
+	settingsbase = {
+		'batterycurrentenabled': ['/Settings/{0}/BatteryCurrent/Enabled', 0, 0, 1],
+		'batterycurrentstart': ['/Settings/{0}/BatteryCurrent/StartValue', 10.5, 0.5, 10000],
+		'batterycurrentstop': ['/Settings/{0}/BatteryCurrent/StopValue', 5.5, 0, 10000],
+		'batterycurrentstarttimer': ['/Settings/{0}/BatteryCurrent/StartTimer', 20, 0, 10000],
+		'batterycurrentstoptimer': ['/Settings/{0}/BatteryCurrent/StopTimer', 20, 0, 10000],
+		'qh_batterycurrentstart': ['/Settings/{0}/BatteryCurrent/QuietHoursStartValue', 20.5, 0, 10000],
+		'qh_batterycurrentstop': ['/Settings/{0}/BatteryCurrent/QuietHoursStopValue', 15.5, 0, 10000]
+		}
+
+	def value(self, startstop, get_value):
+		current = get_value(startstop._battery_service or '', startstop._battery_current_path)
+		# Discharge current is compared as a positive value
+		return current * -1 if current else current
+
+@register
+class BatteryVoltageCondition(Condition):
+	__slots__ = ()
+	name = 'batteryvoltage'
+	monitoring = 'battery'
+	inputs = (('battery', '/Dc/0/Voltage'), ('battery', '/Dc/1/Voltage'))
+	settingsbase = {
+		'batteryvoltageenabled': ['/Settings/{0}/BatteryVoltage/Enabled', 0, 0, 1],
+		'batteryvoltagestart': ['/Settings/{0}/BatteryVoltage/StartValue', 11.5, 0, 150],
+		'batteryvoltagestop': ['/Settings/{0}/BatteryVoltage/StopValue', 12.4, 0, 150],
+		'batteryvoltagestarttimer': ['/Settings/{0}/BatteryVoltage/StartTimer', 20, 0, 10000],
+		'batteryvoltagestoptimer': ['/Settings/{0}/BatteryVoltage/StopTimer', 20, 0, 10000],
+		'qh_batteryvoltagestart': ['/Settings/{0}/BatteryVoltage/QuietHoursStartValue', 11.9, 0, 100],
+		'qh_batteryvoltagestop': ['/Settings/{0}/BatteryVoltage/QuietHoursStopValue', 12.4, 0, 100]
+		}
+
+	def value(self, startstop, get_value):
+		return get_value(startstop._battery_service or '', startstop._battery_voltage_path)
+
+class AlarmCondition(Condition):
+	# When the multi is connected to CAN-bus the alarm is published to
+	# /Alarms/<alarm>, but when connected to vebus it is splitted in three
+	# phases and published to /Alarms/LX/<alarm>.
+	__slots__ = ()
+	monitoring = 'vebus'
+	boolean = True
+	alarm_path = None
+	# The highest phase of the measurement is the alarm
+	measurements = ()
+
+	def value(self, startstop, get_value):
+		value = get_value(startstop._vebusservice or '', self.alarm_path)
+		if value == None:
+			phases = startstop._phases.get(startstop._vebusservice, self.measurements[0])
+			value = phases.max if phases is not None else None
+		return value
+
+@register
+class InverterHighTempCondition(AlarmCondition):
+	__slots__ = ()
+	name = 'inverterhightemp'
+	alarm_path = '/Alarms/HighTemperature'
+	measurements = ('hightemp',)
+	inputs = tuple(('vebus', path) for path in (alarm_path,) + hightemp_paths)
+	settingsbase = {
+		'inverterhightempenabled': ['/Settings/{0}/InverterHighTemp/Enabled', 0, 0, 1],
+		'inverterhightempstarttimer': ['/Settings/{0}/InverterHighTemp/StartTimer', 20, 0, 10000],
+		'inverterhightempstoptimer': ['/Settings/{0}/InverterHighTemp/StopTimer', 20, 0, 10000]
+		}
+
+@register
+class InverterOverloadCondition(AlarmCondition):
+	__slots__ = ()
+	name = 'inverteroverload'
+	alarm_path = '/Alarms/Overload'
+	measurements = ('overload',)
+	inputs = tuple(('vebus', path) for path in (alarm_path,) + overload_paths)
+	settingsbase = {
+		'inverteroverloadenabled': ['/Settings/{0}/InverterOverload/Enabled', 0, 0, 1],
+		'inverteroverloadstarttimer': ['/Settings/{0}/InverterOverload/StartTimer', 20, 0, 10000],
+		'inverteroverloadstoptimer': ['/Settings/{0}/InverterOverload/StopTimer', 20, 0, 10000]
+		}
+
+@register
+class StopOnAc1Condition(Condition):
+	# Keeps the generator stopped while AC input 1 is available
+	__slots__ = ()
+	name = 'stoponac1'
+	monitoring = 'vebus'
+	inputs = (('vebus', '/Ac/ActiveIn/ActiveInput'), ('vebus', '/Ac/ActiveIn/Connected'))
+	boolean = True
+	timed = False
+	inhibit = True
+	settingsbase = {
+		'stoponac1enabled': ['/Settings/{0}/StopWhenAc1Available', 0, 0, 10]
+		}
+
+	def value(self, startstop, get_value):
+		vebus_service = startstop._vebusservice or ''
+		# AC input 1
+		activein = get_value(vebus_service, '/Ac/ActiveIn/ActiveInput')
+		# Active input is connected
+		connected = get_value(vebus_service, '/Ac/ActiveIn/Connected')
+		if None in (activein, connected):
+			return None
+		return activein == 0 and connected == 1
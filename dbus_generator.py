@@ -16,8 +16,14 @@ from dbusmonitor import DbusMonitor
 from settingsdevice import SettingsDevice
 from logger import setup_logging
 import logging
-from gen_utils import dummy
+from gen_utils import dummy, DbusValueDispatcher, InputSnapshot, ServiceIndex, PhaseAggregates
+from clock import SystemClock
+from recorder import Recorder
+from instrumentation import Instrumentation
 import time
+import math
+import json
+import conditions
 import relay
 import fischerpanda
 
@@ -27,7 +33,28 @@ class Generator:
 	def __init__(self):
 		self._exit = False
 		self._instances = {}
+		# Name of each instance, unique per module: FischerPanda0, FischerPanda1...
+		self._names = {}
+		# Settings device of each instance name
+		self._instancesettings = {}
 		self._modules = [relay, fischerpanda]
+		self._dispatcher = DbusValueDispatcher()
+		# Services on the dbus by type and device instance, shared by the instances
+		self._serviceindex = ServiceIndex()
+		# Local day index, the instances are told when it changes
+		self._day = None
+		# Time between ticks in ms while an instance is active, the mainloop
+		# wakes up earlier when a deadline of one of the instances expires
+		# before. Idle instances are ticked at their own, longer interval.
+		self._tickinterval = 1000
+		self._timerinterval = self._tickinterval
+		self._timerid = None
+		# Set while ticking, the end of the tick sets the next interval
+		self._ticking = False
+		# Recorder of the values and settings seen, see start_recording()
+		self._recorder = None
+		# Path of each instance setting
+		self._settingpaths = {}
 
 		# Common dbus services/path
 		commondbustree = {
@@ -76,60 +103,24 @@ class Generator:
 			}
 
 		# Settings base
-		settingsbase = {
+		self._settingsbase = settingsbase = {
 			'autostart': ['/Settings/{0}/AutoStartEnabled', 1, 0, 1],
 			'batterymeasurement': ['/Settings/{0}/Service', '', 0, 0],
 			'accumulateddaily': ['/Settings/{0}/AccumulatedDaily', '', 0, 0, True],
 			'accumulatedtotal': ['/Settings/{0}/AccumulatedTotal', 0, 0, 0, True],
+			# Runtime counters are saved at most once per interval, and when the generator stops
+			'accumulatedsaveinterval': ['/Settings/{0}/AccumulatedSaveInterval', 600, 0, 86400],  # seconds
 			'batterymeasurement': ['/Settings/{0}/BatteryService', 'default', 0, 0],
 			'minimumruntime': ['/Settings/{0}/MinimumRuntime', 0, 0, 86400],  # minutes
-			'stoponac1enabled': ['/Settings/{0}/StopWhenAc1Available', 0, 0, 10],
+			# Tick interval while stopped and idle, the longest time till a
+			# change of a polled value, like /ManualStart, is seen
+			'idletickinterval': ['/Settings/{0}/IdleTickInterval', 10, 1, 30],  # seconds
 			# On permanent loss of communication: 0 = Stop, 1 = Start, 2 = keep running
 			'onlosscommunication': ['/Settings/{0}/OnLossCommunication', 0, 0, 2],
 			# Quiet hours
 			'quiethoursenabled': ['/Settings/{0}/QuietHours/Enabled', 0, 0, 1],
 			'quiethoursstarttime': ['/Settings/{0}/QuietHours/StartTime', 75600, 0, 86400],
 			'quiethoursendtime': ['/Settings/{0}/QuietHours/EndTime', 21600, 0, 86400],
-			# SOC
-			'socenabled': ['/Settings/{0}/Soc/Enabled', 0, 0, 1],
-			'socstart': ['/Settings/{0}/Soc/StartValue', 80, 0, 100],
-			'socstop': ['/Settings/{0}/Soc/StopValue', 90, 0, 100],
-			'qh_socstart': ['/Settings/{0}/Soc/QuietHoursStartValue', 90, 0, 100],
-			'qh_socstop': ['/Settings/{0}/Soc/QuietHoursStopValue', 90, 0, 100],
-			# Voltage
-			'batteryvoltageenabled': ['/Settings/{0}/BatteryVoltage/Enabled', 0, 0, 1],
-			'batteryvoltagestart': ['/Settings/{0}/BatteryVoltage/StartValue', 11.5, 0, 150],
-			'batteryvoltagestop': ['/Settings/{0}/BatteryVoltage/StopValue', 12.4, 0, 150],
-			'batteryvoltagestarttimer': ['/Settings/{0}/BatteryVoltage/StartTimer', 20, 0, 10000],
-			'batteryvoltagestoptimer': ['/Settings/{0}/BatteryVoltage/StopTimer', 20, 0, 10000],
-			'qh_batteryvoltagestart': ['/Settings/{0}/BatteryVoltage/QuietHoursStartValue', 11.9, 0, 100],
-			'qh_batteryvoltagestop': ['/Settings/{0}/BatteryVoltage/QuietHoursStopValue', 12.4, 0, 100],
-			# Current
-			'batterycurrentenabled': ['/Settings/{0}/BatteryCurrent/Enabled', 0, 0, 1],
-			'batterycurrentstart': ['/Settings/{0}/BatteryCurrent/StartValue', 10.5, 0.5, 10000],
-			'batterycurrentstop': ['/Settings/{0}/BatteryCurrent/StopValue', 5.5, 0, 10000],
-			'batterycurrentstarttimer': ['/Settings/{0}/BatteryCurrent/StartTimer', 20, 0, 10000],
-			'batterycurrentstoptimer': ['/Settings/{0}/BatteryCurrent/StopTimer', 20, 0, 10000],
-			'qh_batterycurrentstart': ['/Settings/{0}/BatteryCurrent/QuietHoursStartValue', 20.5, 0, 10000],
-			'qh_batterycurrentstop': ['/Settings/{0}/BatteryCurrent/QuietHoursStopValue', 15.5, 0, 10000],
-			# AC load
-			'acloadenabled': ['/Settings/{0}/AcLoad/Enabled', 0, 0, 1],
-			# Measuerement, 0 = Total AC consumption, 1 = AC on inverter output, 2 = Single phase
-			'acloadmeasuerment': ['/Settings/{0}/AcLoad/Measurement', 0, 0, 100],
-			'acloadstart': ['/Settings/{0}/AcLoad/StartValue', 1600, 5, 100000],
-			'acloadstop': ['/Settings/{0}/AcLoad/StopValue', 800, 0, 100000],
-			'acloadstarttimer': ['/Settings/{0}/AcLoad/StartTimer', 20, 0, 10000],
-			'acloadstoptimer': ['/Settings/{0}/AcLoad/StopTimer', 20, 0, 10000],
-			'qh_acloadstart': ['/Settings/{0}/AcLoad/QuietHoursStartValue', 1900, 0, 100000],
-			'qh_acloadstop': ['/Settings/{0}/AcLoad/QuietHoursStopValue', 1200, 0, 100000],
-			# VE.Bus high temperature
-			'inverterhightempenabled': ['/Settings/{0}/InverterHighTemp/Enabled', 0, 0, 1],
-			'inverterhightempstarttimer': ['/Settings/{0}/InverterHighTemp/StartTimer', 20, 0, 10000],
-			'inverterhightempstoptimer': ['/Settings/{0}/InverterHighTemp/StopTimer', 20, 0, 10000],
-			# VE.Bus overload
-			'inverteroverloadenabled': ['/Settings/{0}/InverterOverload/Enabled', 0, 0, 1],
-			'inverteroverloadstarttimer': ['/Settings/{0}/InverterOverload/StartTimer', 20, 0, 10000],
-			'inverteroverloadstoptimer': ['/Settings/{0}/InverterOverload/StopTimer', 20, 0, 10000],
 			# TestRun
 			'testrunenabled': ['/Settings/{0}/TestRun/Enabled', 0, 0, 1],
 			'testrunstartdate': ['/Settings/{0}/TestRun/StartDate', 1483228800, 0, 10000000000.1],
@@ -141,19 +132,19 @@ class Generator:
 			# Alarms
 			'nogeneratoratacinalarm': ['/Settings/{0}/Alarms/NoGeneratorAtAcIn', 0, 0, 1]
 			}
+		# Each condition declares its own settings
+		settingsbase.update(conditions.get_settingsbase())
 
 		settings = {}
-		dbus_tree = dict(commondbustree)
+		self._dbustree = dbus_tree = dict(commondbustree)
 
 		for m in self._modules:
-			# Create settings for each module
-			# Settings are created under the module prefix, for example:
+			# Create settings for the first instance of each module
+			# Settings are created under the instance name, for example:
 			# /Settings/Generator0/AcLoad/Enabled
 			# /Settings/FischerPanda0/AcLoad/Enabled
-			for s in settingsbase:
-				v = settingsbase[s][:]  # Copy
-				v[0] = v[0].format(m.name)
-				settings[s + m.name] = v
+			# The ones of other instances are created with the instance.
+			settings.update(self._get_instance_settings(m.prefix + '0'))
 
 			# Get all services/paths that must be monitored
 			# There are a base of common services/pathas that must be monitored
@@ -167,61 +158,154 @@ class Generator:
 				else:
 					dbus_tree[i] = m.monitoring[i]
 
+		# Track built-in relays
+		self._dispatcher.register('com.victronenergy.settings', '/Settings/Relay/Function',
+								self._relay_function_changed)
+
+		# Applied to the clock, the instances follow it
+		self._dispatcher.register('com.victronenergy.settings', '/Settings/System/TimeZone',
+								self._timezone_changed)
+
+		# Some devices like Fischer Panda gensets doesn't disappear from dbus
+		# when disconnected so check '/Connected' value to add or remove start/stop
+		# for that device
+		for m in self._modules:
+			self._dispatcher.register(m.remoteprefix, '/Connected', self._connected_changed)
+
+		# Clock shared by all the instances
+		self._clock = self._create_clock()
+
+		# Name of the instance of each device, see _get_name()
+		settings['instancenames'] = ['/Settings/GeneratorStartStop/InstanceNames', '', 0, 0]
+		self._settingpaths['instancenames'] = settings['instancenames'][0]
+
 		# Create settings device which is shared
 		self._settings = self._create_settings(settings, self._handlechangedsetting)
+		for m in self._modules:
+			self._instancesettings[m.prefix + '0'] = self._settings
 
 		# Create dbusmonitor, this is shared by all the instances
 		self._dbusmonitor = self._create_dbus_monitor(dbus_tree, valueChangedCallback=self._dbus_value_changed,
 				deviceAddedCallback=self._device_added, deviceRemovedCallback=self._device_removed)
 
+		# Sums and maximums of the per phase values read by the conditions,
+		# updated on each change of a phase instead of on each evaluation.
+		# Only the measurements of enabled conditions, see _subscribe_phases()
+		self._phases = PhaseAggregates(self._dbusmonitor)
+		self._phasesubscriptions = set()
+		for name, source, paths in conditions.phase_measurements:
+			self._phases.add_measurement(name, paths)
+
 		# Create dbus service
 		# Paths for each instance will be added to this service like:
 		# com.victronenergy.generator.startstop0/FischerPanda0/State
 		# com.victronenergy.generator.startstop0/Generator0/State
 		self._dbusservice = self._create_dbus_service()
 
-		# Call device_added for all existing devices at startup.
-		for service, instance in self._dbusmonitor.get_service_list().items():
+		# Timezone set by the user, before the instances use the local time
+		self._clock.set_timezone(self._dbusmonitor.get_value('com.victronenergy.settings',
+															'/Settings/System/TimeZone'))
+
+		# Timing of the tick and the dispatch
+		self._instrumentation = Instrumentation(self._dbusservice)
+		self._dispatcher.set_timing(self._instrumentation.timer, self._instrumentation.handled)
+
+		# Call device_added for all existing devices at startup. All of them are
+		# indexed first, so the instances created on the way find their services.
+		services = self._dbusmonitor.get_service_list()
+		for service, instance in services.items():
+			self._serviceindex.add(service, instance)
+		for service, instance in services.items():
 				self._device_added(service, instance)
 
-		gobject.timeout_add(1000, exit_on_error, self._handletimertick)
+		self._schedule_tick(self._tickinterval)
+
+	def start_recording(self, recorder):
+		# Current values and settings first, the changes follow
+		# with the same time, so they are replayed at once
+		self._recorder = recorder
+		t = self._clock.time()
+		for service, instance in self._dbusmonitor.get_service_list().items():
+			self._record_service(t, service, instance)
+		for name, settings in self._instancesettings.items():
+			self._record_settings(t, name, settings)
+
+	def _record_service(self, t, service, instance):
+		self._recorder.record(t, service, '/DeviceInstance', instance)
+		paths = self._dbustree.get('.'.join(service.split('.')[:3]), {})
+		for path in paths:
+			value = self._dbusmonitor.get_value(service, path)
+			if value is not None:
+				self._recorder.record(t, service, path, value)
+
+	def _record_settings(self, t, name, settings):
+		for s in self._settingsbase:
+			self._recorder.record(t, 'com.victronenergy.settings',
+								self._settingpaths[s + name], settings[s + name])
 
 	def _handlechangedsetting(self, setting, oldvalue, newvalue):
+		if self._recorder is not None:
+			self._recorder.record(self._clock.time(), 'com.victronenergy.settings',
+								self._settingpaths[setting], newvalue)
 		for i in self._instances:
 			self._instances[i].handlechangedsetting(setting, oldvalue, newvalue)
+			# Enabling/disabling conditions changes the inputs to monitor
+			if self._instances[i].subscriptions_changed():
+				self._subscribe(i)
+		self._wakeup()
 
 	def _device_added(self, dbusservicename, instance):
-		# If settings check built-in relays
+		self._serviceindex.add(dbusservicename, instance)
+		self._phases.reset(dbusservicename)
+		if self._recorder is not None:
+			self._record_service(self._clock.time(), dbusservicename, instance)
+
+		# If settings apply the timezone and check built-in relays
 		if dbusservicename == 'com.victronenergy.settings':
+			self._clock.set_timezone(self._dbusmonitor.get_value(dbusservicename,
+																'/Settings/System/TimeZone'))
 			self._handle_builtin_relay('/Settings/Relay/Function')
 
 		self._add_device(dbusservicename)
 
 		for i in self._instances:
 			self._instances[i].device_added(dbusservicename, instance)
+		self._wakeup()
 
 	def _dbus_value_changed(self, dbusServiceName, dbusPath, options, changes, deviceInstance):
-		# Track built-in relays
-		if "/Settings/Relay/Function" in dbusPath:
-			self._handle_builtin_relay(dbusPath)
-
-		# Some devices like Fischer Panda gensets doesn't disappear from dbus
-		# when disconnected so check '/Connected' value to add or remove start/stop
-		# for that device
-		if dbusPath == "/Connected":
-			if self._dbusmonitor.get_value(dbusServiceName, dbusPath) == 0:
-				self._remove_device(dbusServiceName)
-			else:
-				self._add_device(dbusServiceName)
-
-		for i in self._instances:
-			self._instances[i].dbus_value_changed(dbusServiceName, dbusPath, options, changes, deviceInstance)
+		if self._recorder is not None:
+			self._recorder.record(self._clock.time(), dbusServiceName, dbusPath,
+								self._dbusmonitor.get_value(dbusServiceName, dbusPath))
+		timer = self._instrumentation.timer
+		start = timer()
+		ran = self._dispatcher.dispatch(dbusServiceName, dbusPath, options, changes, deviceInstance)
+		self._instrumentation.dispatch.add(timer() - start)
+		# Only a change handled by someone can need an evaluation
+		if ran and self._timerinterval > self._tickinterval:
+			self._wakeup()
+
+	def _timezone_changed(self, dbusServiceName, dbusPath, options, changes, deviceInstance):
+		self._clock.set_timezone(self._dbusmonitor.get_value(dbusServiceName, dbusPath))
+
+	def _relay_function_changed(self, dbusServiceName, dbusPath, options, changes, deviceInstance):
+		self._handle_builtin_relay(dbusPath)
+
+	def _connected_changed(self, dbusServiceName, dbusPath, options, changes, deviceInstance):
+		if self._dbusmonitor.get_value(dbusServiceName, dbusPath) == 0:
+			self._remove_device(dbusServiceName)
+		else:
+			self._add_device(dbusServiceName)
 
 	def _device_removed(self, dbusservicename, instance):
+		self._serviceindex.remove(dbusservicename, instance)
+		self._phases.reset(dbusservicename)
+		if self._recorder is not None:
+			self._recorder.removed(self._clock.time(), dbusservicename)
 		if dbusservicename == 'com.victronenergy.settings':
 			self._handle_builtin_relay('/Settings/Relay/Function')
 		for i in self._instances:
 			self._instances[i].device_removed(dbusservicename, instance)
+		self._wakeup()
 
 	def _create_dbus_monitor(self, *args, **kwargs):
 		return DbusMonitor(*args, **kwargs)
@@ -230,16 +314,85 @@ class Generator:
 		bus = dbus.SessionBus() if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else dbus.SystemBus()
 		return SettingsDevice(bus, *args, timeout=10, **kwargs)
 
+	def _create_clock(self):
+		return SystemClock()
+
+	def _get_instance_settings(self, name):
+		settings = {}
+		for s in self._settingsbase:
+			v = self._settingsbase[s][:]  # Copy
+			v[0] = v[0].format(name)
+			settings[s + name] = v
+			self._settingpaths[s + name] = v[0]
+		return settings
+
+	def _get_settings(self, name):
+		# Settings device holding the settings of the instance
+		if name not in self._instancesettings:
+			self._instancesettings[name] = self._create_settings(
+				self._get_instance_settings(name), self._handlechangedsetting)
+			if self._recorder is not None:
+				self._record_settings(self._clock.time(), name, self._instancesettings[name])
+		return self._instancesettings[name]
+
+	def _get_saved_names(self):
+		# Instance name of each device identity, as json in the settings
+		try:
+			names = json.loads(self._settings['instancenames'] or '{}')
+		except ValueError:
+			names = {}
+		return names if isinstance(names, dict) else {}
+
+	def _get_name(self, key, module, identity=None):
+		# An instance replacing another one for the same key keeps its name.
+		# The name of a device is saved with its identity, so it gets the same
+		# settings and runtime back after a restart or reconnect, whatever the
+		# order the devices are found in. New ones get the lowest number of
+		# the module that is neither in use nor saved for another device.
+		if key in self._names:
+			return self._names[key]
+		saved = self._get_saved_names() if identity is not None else {}
+		name = saved.get(identity)
+		if name is None or not name.startswith(module.prefix) or name in self._names.values():
+			names = set(self._names.values()) | set(saved.values())
+			n = 0
+			while module.prefix + str(n) in names:
+				n += 1
+			name = module.prefix + str(n)
+			# Two devices with the same identity, only the first keeps its name
+			if identity is not None and identity not in saved:
+				saved[identity] = name
+				self._settings['instancenames'] = json.dumps(saved, sort_keys=True)
+		self._names[key] = name
+		return name
+
+	def _create_instance(self, key, module, remoteservice, identity=None):
+		name = self._get_name(key, module, identity)
+		# The instance replaced shares the paths and settings of the new one,
+		# its counters are saved before they are taken over
+		if key in self._instances:
+			self._instances[key].flush()
+		self._set_instance(key, module.create(self._dbusmonitor,
+											self._dbusservice,
+											remoteservice,
+											self._get_settings(name),
+											self._clock,
+											self._serviceindex,
+											self._phases,
+											self._wakeup,
+											name))
+
 	def _add_device(self, service):
 		for i in self._modules:
 			# Check if module can handle this service
 			if i.remoteprefix not in service:
 				continue
-			# Check and create start/stop instance for the device
+			# Check and create start/stop instance for the device, its
+			# identity being the service type and the device instance
 			if i.check_device(self._dbusmonitor, service):
-				self._instances[service] = i.create(self._dbusmonitor,
-												self._dbusservice,
-												service, self._settings)
+				instance = self._dbusmonitor.get_value(service, '/DeviceInstance')
+				identity = None if instance is None else '%s/%s' % (ServiceIndex.service_type(service), instance)
+				self._create_instance(service, i, service, identity)
 
 	def _handle_builtin_relay(self, dbuspath):
 		function = self._dbusmonitor.get_value('com.victronenergy.settings', dbuspath)
@@ -249,40 +402,146 @@ class Generator:
 		# Create a instance if relay function is set to 1 (gen. start/stop)
 		# otherwise remove the instance if exists
 		if function == 1:
-			self._instances[relaynr] = relay.create(self._dbusmonitor,
-													self._dbusservice,
-													relayservice,
-													self._settings)
+			self._create_instance(relaynr, relay, relayservice)
 		elif relaynr in self._instances:
-			self._instances[relaynr].remove()
-			del self._instances[relaynr]
+			self._remove_instance(relaynr)
 
 	def _remove_device(self, servicename):
 		if servicename in self._instances:
 			if self._instances[servicename] is not None:
-				self._instances[servicename].remove()
-				del self._instances[servicename]
+				self._remove_instance(servicename)
+
+	def _set_instance(self, key, instance):
+		# A previous instance for the same key stops receiving value changes
+		if key in self._instances:
+			self._dispatcher.unregister(self._instances[key])
+			self._instrumentation.remove_instance(self._instances[key])
+		self._instances[key] = instance
+		self._instrumentation.add_instance(instance, self._names[key])
+		self._subscribe(key)
+
+	def _subscribe(self, key):
+		# (Re)register the value change handlers of an instance
+		instance = self._instances[key]
+		self._dispatcher.unregister(instance)
+		for serviceprefix, path, handler in instance.dbus_value_handlers():
+			self._dispatcher.register(serviceprefix, path, handler)
+		self._subscribe_phases()
+
+	def _subscribe_phases(self):
+		# (Re)register the handlers of the per phase measurements read by
+		# the enabled conditions of all the instances
+		measurements = set()
+		for i in self._instances.values():
+			measurements.update(i.phase_measurements())
+		if measurements == self._phasesubscriptions:
+			return
+		self._phasesubscriptions = measurements
+		self._dispatcher.unregister(self._phases)
+		self._phases.track(measurements)
+		for name, source, paths in conditions.phase_measurements:
+			if name in measurements:
+				for path in paths:
+					self._dispatcher.register('com.victronenergy.' + source, path, self._phases.changed)
+
+	def _remove_instance(self, key):
+		self._dispatcher.unregister(self._instances[key])
+		self._instrumentation.remove_instance(self._instances[key])
+		self._instances[key].remove()
+		del self._instances[key]
+		del self._names[key]
+		self._subscribe_phases()
 
 	def terminate(self, signum, frame):
 		# Remove instances before exiting, remote services might need to perform actions before releasing control
-		# of the switch
+		# of the switch. Removing also saves the runtime counters not written yet.
 		for i in self._instances:
 			self._instances[i].remove()
+		if self._recorder is not None:
+			self._recorder.close()
 		os._exit(0)
 
 	def _handletimertick(self):
 		# try catch, to make sure that we kill ourselves on an error. Without this try-catch, there would
 		# be an error written to stdout, and then the timer would not be restarted, resulting in a dead-
 		# lock waiting for manual intervention -> not good!
+		self._ticking = True
 		try:
+			instrumentation = self._instrumentation
+			timer = instrumentation.timer
+			start = timer()
+			# All the instances evaluate the same input values at the same time
+			snapshot = InputSnapshot(self._dbusmonitor)
+			now = self._clock.read()
+			if now.day != self._day:
+				# One rollover per local day
+				self._day = now.day
+				for i in self._instances:
+					self._instances[i].day_changed(now)
 			for i in self._instances:
-				self._instances[i].tick()
+				t = timer()
+				self._instances[i].tick(snapshot, now)
+				instrumentation.instance_stats(self._instances[i]).tick.add(timer() - t)
+			end = timer()
+			instrumentation.tick.add(end - start)
+			instrumentation.publish(end)
 		except:
-			self._instances[i].remove()
 			import traceback
 			traceback.print_exc()
+			# The error is not necessarily in one of the instances, all of
+			# them release their remote switch before exiting
+			for key in self._instances.keys():
+				try:
+					self._instances[key].remove()
+				except:
+					traceback.print_exc()
 			sys.exit(1)
-		return True
+		finally:
+			self._ticking = False
+
+		# Sleep till the next tick or till the first deadline if it expires before,
+		# the timer is only replaced when the interval changes.
+		interval = int(math.ceil((now.nextmidnight - now.time) * 1000))
+		for i in self._instances.values():
+			ticks = i.tick_interval(self._tickinterval)
+			if ticks is not None:
+				interval = min(interval, ticks)
+			deadline = i.next_deadline()
+			if deadline is not None:
+				interval = min(interval, int(math.ceil(deadline * 1000)))
+		if interval == self._timerinterval:
+			return True
+		self._timerinterval = interval
+		# Returning False removes the running timer
+		self._timerid = None
+		self._schedule_tick(interval)
+		return False
+
+	def _wakeup(self):
+		# A change while the mainloop sleeps for an idle interval is evaluated
+		# within the active interval, as if it never slept longer. A change
+		# seen while ticking is left to the end of the tick, which sees the
+		# same instance intervals and replaces the running timer.
+		if self._ticking or self._timerinterval <= self._tickinterval:
+			return
+		for i in self._instances.values():
+			ticks = i.tick_interval(self._tickinterval)
+			if ticks is not None and ticks <= self._tickinterval:
+				break
+		else:
+			return
+		self._cancel_tick()
+		self._timerinterval = self._tickinterval
+		self._schedule_tick(self._tickinterval)
+
+	def _schedule_tick(self, interval):
+		# Interval in ms
+		self._timerid = gobject.timeout_add(interval, exit_on_error, self._handletimertick)
+
+	def _cancel_tick(self):
+		if self._timerid is not None:
+			gobject.source_remove(self._timerid)
+			self._timerid = None
 
 	def _create_dbus_service(self):
 		dbusservice = VeDbusService("com.victronenergy.generator.startstop0")
@@ -306,6 +565,10 @@ if __name__ == '__main__':
 
 	parser.add_argument('-d', '--debug', help='set logging level to debug',
 						action='store_true')
+	parser.add_argument('-r', '--record', help='record the dbus values and settings to a file, see recorder.py',
+						metavar='FILE')
+	parser.add_argument('--record-size', help='size in bytes at which the recording is rotated',
+						type=int, default=4 * 1024 * 1024)
 	args = parser.parse_args()
 
 	print '-------- dbus_generator, v' + softwareversion + ' is starting up --------'
@@ -317,6 +580,8 @@ if __name__ == '__main__':
 
 	generator = Generator()
 	signal.signal(signal.SIGTERM, generator.terminate)
+	if args.record:
+		generator.start_recording(Recorder(args.record, args.record_size))
 
 	# Start and run the mainloop
 	mainloop = gobject.MainLoop()
@@ -6,7 +6,8 @@ import logging
 from gen_utils import dummy, Errors
 
 remoteprefix = 'com.victronenergy.genset'
-name = "FischerPanda0"
+# Instances are named prefix + number: FischerPanda0, FischerPanda1...
+prefix = "FischerPanda"
 productid = 0xB040
 
 # List of the service/paths we need to monitor
@@ -35,12 +36,14 @@ def check_device(dbusmonitor, dbusservicename):
 		return False
 	return True
 
-def create(dbusmonitor, dbusservice, remoteservice, settings):
+def create(dbusmonitor, dbusservice, remoteservice, settings, clock, serviceindex, phases, wakeup, name):
 	i = FischerPandaGenerator()
-	i.set_sources(dbusmonitor, dbusservice, settings, name, remoteservice)
+	i.set_sources(dbusmonitor, dbusservice, settings, name, remoteservice, clock, serviceindex, phases, wakeup)
 	return i
 
 class FischerPandaGenerator(StartStop):
+	remote_inputs = ('/AutoStart', '/ErrorCode', '/Start')
+
 	def _remote_setup(self):
 		# Enable if autostart is enabled for FischerPanda, later checks will be done by
 		# the dbus_value_changed event.
@@ -69,17 +72,19 @@ class FischerPandaGenerator(StartStop):
 			return 0
 		return self._dbusmonitor.get_value(self._remoteservice, '/Start')
 
-	def dbus_value_changed(self, dbusServiceName, dbusPath, options, changes, deviceInstance):
+	def dbus_value_handlers(self):
+		return StartStop.dbus_value_handlers(self) + [
+			('com.victronenergy.settings', '/Settings/Services/FischerPandaAutoStartStop',
+				self._autostartstop_changed)
+			]
+
+	def _autostartstop_changed(self, dbusServiceName, dbusPath, options, changes, deviceInstance):
 		# Check if the user enabled or disabled the auto start/stop functionality for the Fischer Panda.
-		value = None
-		if dbusServiceName == 'com.victronenergy.settings':
-			if dbusPath == '/Settings/Services/FischerPandaAutoStartStop':
-				value = self._dbusmonitor.get_value(dbusServiceName, dbusPath)
+		value = self._dbusmonitor.get_value(dbusServiceName, dbusPath)
 		if value == 1:
- 			self.enable()
+			self.enable()
 		elif value == 0:
 			self.disable()
-		StartStop.dbus_value_changed(self, dbusServiceName, dbusPath, options, changes, deviceInstance)
 
 	def _set_remote_switch_state(self, value):
 		error = self._dbusservice['/Error']
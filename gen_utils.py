@@ -33,24 +33,66 @@ class States:
 			pass
 		return d
 
-class SettingsPrefix:
+class SettingsView(object):
+	""" Settings of one instance with attribute style access, settings.socstart
+	reads the socstart<prefix> setting. A value is fetched from the settings
+	device the first time it's read and kept up to date by update(), called
+	from the changed setting handler, so reading it is an attribute lookup.
+	bind() copies a setting into an attribute of another object, for example
+	the settings of each condition. """
 	def __init__(self, settings, prefix):
 		self._settings = settings
 		self._prefix = prefix
+		self._fields = {}
+
+	def bind(self, obj, attribute, setting):
+		setting += self._prefix
+		self._fields.setdefault(setting, []).append((obj, attribute))
+		setattr(obj, attribute, self._settings[setting])
+
+	def update(self, setting, value):
+		for obj, attribute in self._fields.get(setting, ()):
+			setattr(obj, attribute, value)
 
 	def removeprefix(self, setting):
 		return setting.replace(self._prefix, "")
 
+	def __getattr__(self, setting):
+		# Only called the first time, afterwards the attribute exists
+		if setting.startswith('_'):
+			raise AttributeError(setting)
+		self.bind(self, setting, setting)
+		return self.__dict__[setting]
+
 	def __getitem__(self, setting):
-			return self._settings[setting + self._prefix]
+		return getattr(self, setting)
 
 	def __setitem__(self, setting, value):
 		self._settings[setting + self._prefix] = value
+		# The change notification of the settings device might come later
+		self.update(setting + self._prefix, value)
 
 class DBusServicePrefix:
+	""" Paths of an instance on the shared dbus service. Between begin() and
+	commit() writes are only kept here, reads return them, and commit()
+	publishes the last value written to each path, skipping the ones that
+	did not change. A path written several times costs a single signal. """
 	def __init__(self, service, prefix):
 		self._service = service
 		self._prefix = "/" + prefix
+		self._pending = None
+
+	def begin(self):
+		self._pending = {}
+
+	def commit(self):
+		pending, self._pending = self._pending, None
+		if not pending:
+			return
+		service = self._service
+		for path, value in pending.items():
+			if service[path] != value:
+				service[path] = value
 
 	def add_path(self, path, value, description="", writeable=False,
 					onchangecallback=None, gettextcallback=None):
@@ -58,10 +100,188 @@ class DBusServicePrefix:
 							writeable, onchangecallback, gettextcallback)
 
 	def __delitem__(self, path):
-		self._service.__delitem__(self._prefix + path)
+		path = self._prefix + path
+		if self._pending:
+			self._pending.pop(path, None)
+		self._service.__delitem__(path)
 
 	def __getitem__(self, path):
-			return self._service[self._prefix + path]
+		path = self._prefix + path
+		pending = self._pending
+		if pending and path in pending:
+			return pending[path]
+		return self._service[path]
 
 	def __setitem__(self, path, value):
-		self._service[self._prefix + path] = value
\ No newline at end of file
+		if self._pending is not None:
+			self._pending[self._prefix + path] = value
+		else:
+			self._service[self._prefix + path] = value
+
+class InputSnapshot:
+	""" Values of the monitored inputs for one evaluation cycle. Each
+	(service, path) is read from the dbusmonitor once and served from the
+	cache afterwards, so all the instances evaluate the same values. """
+	def __init__(self, dbusmonitor):
+		self._dbusmonitor = dbusmonitor
+		self._values = {}
+
+	def get_value(self, service, path):
+		try:
+			return self._values[service, path]
+		except KeyError:
+			value = self._values[service, path] = self._dbusmonitor.get_value(service, path)
+			return value
+
+class ServiceIndex:
+	""" Services on the dbus by (service type, device instance), the service
+	type being the third part of the name: battery for
+	com.victronenergy.battery.ttyO5. Kept up to date by the Generator from
+	the device added/removed callbacks. """
+	def __init__(self):
+		self._services = {}
+
+	@staticmethod
+	def service_type(service):
+		parts = service.split('.', 3)
+		return parts[2] if len(parts) > 2 else service
+
+	def add(self, service, instance):
+		self._services[self.service_type(service), instance] = service
+
+	def remove(self, service, instance):
+		key = (self.service_type(service), instance)
+		if self._services.get(key) == service:
+			del self._services[key]
+
+	def get(self, service_type, instance):
+		return self._services.get((service_type, instance))
+
+class PhaseValues(object):
+	""" Values of the phases of one measurement of a service, with their sum
+	and maximum kept up to date as each phase changes, so reading them costs
+	an attribute lookup whatever the number of phases. A phase without a
+	value counts as 0 in the sum and is left out of the maximum, which is
+	None while no phase has a value. The sum is made again on each change,
+	a running float sum would drift from the one of the phases. """
+	__slots__ = ('values', 'sum', 'max')
+
+	def __init__(self, values):
+		self.values = list(values)
+		self.sum = sum(filter(None, self.values))
+		self.max = max(self.values)
+
+	def set(self, phase, value):
+		old = self.values[phase]
+		self.values[phase] = value
+		self.sum = sum(filter(None, self.values))
+		if value is not None and (self.max is None or value >= self.max):
+			self.max = value
+		elif old is not None and old == self.max:
+			# Only a decrease of the maximum compares the phases
+			self.max = max(self.values)
+
+class PhaseAggregates(object):
+	""" PhaseValues of each (service, measurement), a measurement being a set
+	of per phase paths like /Ac/Out/L1/P ... /Ac/Out/L3/P. The values of a
+	service are read from the dbusmonitor the first time they are asked for
+	and, for the tracked measurements, kept and updated by changed(), the
+	value change handler of their paths. The others are read on each get().
+	"""
+	def __init__(self, dbusmonitor):
+		self._dbusmonitor = dbusmonitor
+		self._measurements = {}
+		# Measurement and phase of each path
+		self._paths = {}
+		self._values = {}
+		self._tracked = frozenset()
+
+	def add_measurement(self, name, paths):
+		self._measurements[name] = paths
+		for phase, path in enumerate(paths):
+			self._paths[path] = (name, phase)
+
+	def track(self, names):
+		# Measurements whose changes are handled, the values kept for the
+		# others would not be updated anymore
+		self._tracked = frozenset(names)
+		for key in [k for k in self._values if k[1] not in self._tracked]:
+			del self._values[key]
+
+	def get(self, service, name):
+		# None without a service
+		try:
+			return self._values[service, name]
+		except KeyError:
+			pass
+		if not service:
+			return None
+		get_value = self._dbusmonitor.get_value
+		values = PhaseValues(get_value(service, path) for path in self._measurements[name])
+		if name in self._tracked:
+			self._values[service, name] = values
+		return values
+
+	def reset(self, service):
+		# Values of a service added or removed are read again
+		for key in [k for k in self._values if k[0] == service]:
+			del self._values[key]
+
+	def changed(self, service, path, options, changes, deviceinstance):
+		name, phase = self._paths[path]
+		values = self._values.get((service, name))
+		if values is not None:
+			values.set(phase, self._dbusmonitor.get_value(service, path))
+
+class DbusValueDispatcher:
+	""" Routes dbus value changes to the handlers registered for a
+	(service prefix, path) pair. The index is keyed on path so a change
+	nobody registered for costs a single dict lookup. """
+	def __init__(self):
+		self._handlers = {}
+		self._timer = None
+		self._observer = None
+
+	def set_timing(self, timer, observer):
+		# observer(owner, seconds) is called after each handler run, owner
+		# being the object the handler is bound to
+		self._timer = timer
+		self._observer = observer
+
+	def register(self, serviceprefix, path, handler):
+		# Copy on write, handlers might register while a dispatch is running
+		owner = getattr(handler, '__self__', None)
+		self._handlers[path] = self._handlers.get(path, ()) + ((serviceprefix, handler, owner),)
+
+	def unregister(self, owner):
+		# Remove all the handlers bound to owner
+		for path in self._handlers.keys():
+			handlers = tuple(h for h in self._handlers[path] if h[2] is not owner)
+			if handlers:
+				self._handlers[path] = handlers
+			else:
+				del self._handlers[path]
+
+	def dispatch(self, service, path, options, changes, deviceinstance):
+		# Returns the number of handlers run
+		handlers = self._handlers.get(path)
+		if handlers is None:
+			return 0
+		ran = 0
+		timer = self._timer
+		if timer is None:
+			for serviceprefix, handler, owner in handlers:
+				if service.startswith(serviceprefix):
+					handler(service, path, options, changes, deviceinstance)
+					ran += 1
+			return ran
+		observer = self._observer
+		start = timer()
+		for serviceprefix, handler, owner in handlers:
+			if service.startswith(serviceprefix):
+				handler(service, path, options, changes, deviceinstance)
+				end = timer()
+				observer(owner, end - start)
+				start = end
+				ran += 1
+		return ran
@@ -0,0 +1,106 @@
+#!/usr/bin/python -u
+# -*- coding: utf-8 -*-
+
+# Daily runtime history of a generator, kept in memory as a ring buffer with
+# a slot per day. Each slot holds the accumulated runtime up to the end of
+# that day, so the runtime of any interval is the difference of two slots.
+# The json form stored in the AccumulatedDaily setting,
+# {"<utc timestamp of the day>": seconds, ...}, is only parsed when the
+# setting is loaded and only produced when it has to be saved.
+
+import json
+from array import array
+
+class RuntimeHistory:
+	def __init__(self, days):
+		self._days = days
+		# One slot more than the number of days, the total at the end of the
+		# day before the oldest one is needed to get the runtime of all of them
+		self._size = days + 1
+		self._totals = array('l', [0] * self._size)
+		self._today = None
+
+	def _roll(self, day):
+		# Days without runtime keep the total of the last day with runtime
+		if self._today is None:
+			self._today = day
+			return
+		if day <= self._today:
+			return
+		total = self._totals[self._today % self._size]
+		for d in range(day - min(day - self._today, self._size) + 1, day + 1):
+			self._totals[d % self._size] = total
+		self._today = day
+
+	def add(self, day, seconds):
+		self._roll(day)
+		self._totals[self._today % self._size] += int(seconds)
+
+	def runtime(self, day, days=0):
+		# Runtime of day plus the previous days, limited by the history length
+		self._roll(day)
+		days = min(days, self._days - 1)
+		return (self._totals[self._today % self._size] -
+				self._totals[(self._today - days - 1) % self._size])
+
+	def load(self, day, data):
+		# data is the json string of the setting, invalid data gives an
+		# empty history
+		try:
+			daily = dict((int(k) // 86400, int(v)) for k, v in json.loads(data).items())
+		except (ValueError, TypeError, AttributeError):
+			daily = {}
+		total = 0
+		for d in range(day - self._days, day + 1):
+			total += daily.get(d, 0)
+			self._totals[d % self._size] = total
+		self._today = day
+
+	def dumps(self):
+		daily = {}
+		if self._today is not None:
+			for d in range(self._today - self._days + 1, self._today + 1):
+				seconds = self._totals[d % self._size] - self._totals[(d - 1) % self._size]
+				if seconds:
+					daily[str(d * 86400)] = seconds
+		return json.dumps(daily, sort_keys=True)
+
+class RuntimePersistence(object):
+	""" Batches the writes of the accumulated runtime counters to the
+	AccumulatedTotal and AccumulatedDaily settings. Each write is a D-Bus
+	round trip ending up in flash, so runtime is added in memory and only
+	written by flush(). Runtime added since the last flush is what would be
+	lost on a power failure. """
+	def __init__(self, settings, history):
+		self._settings = settings
+		self._history = history
+		# Seconds not yet added to AccumulatedTotal
+		self._pending = 0
+		self._dirty = False
+		self.flushes = 0
+		# Last AccumulatedDaily value written
+		self.json = None
+
+	@property
+	def dirty(self):
+		return self._dirty
+
+	@property
+	def pending(self):
+		return self._pending
+
+	def add(self, day, seconds):
+		self._history.add(day, seconds)
+		self._pending += seconds
+		self._dirty = True
+
+	def flush(self):
+		if not self._dirty:
+			return
+		# Added to the current value, which might have been reset by the user
+		self._settings['accumulatedtotal'] = int(self._settings.accumulatedtotal) + self._pending
+		self.json = self._history.dumps()
+		self._settings['accumulateddaily'] = self.json
+		self._pending = 0
+		self._dirty = False
+		self.flushes += 1
@@ -0,0 +1,127 @@
+#!/usr/bin/python -u
+# -*- coding: utf-8 -*-
+
+# Timing of the tick and of the dbus value change dispatch, published under
+# /Debug of com.victronenergy.generator.startstop0:
+#   /Debug/Tick/..., /Debug/Dispatch/...          the whole Generator
+#   /Debug/<instance>/Tick/..., .../Dispatch/...  each start/stop instance
+# with P50, P95 and Max in ms and Count for each of them, plus the
+# Evaluations, SkippedEvaluations and ValueChanges counters per instance.
+
+import time
+
+# Durations are measured with time.time(), the monotonic clock costs more
+# than a dispatch. A sample longer than this is a step of the wall clock.
+MAX_SAMPLE = 3600
+
+class TimingStats(object):
+	""" Histogram of durations with a bucket per power of two microseconds,
+	adding a sample is O(1). Percentiles are the upper bound of the bucket
+	they fall in, limited by the largest sample. """
+	__slots__ = ('buckets', 'count', 'max')
+	BUCKETS = 32
+
+	def __init__(self):
+		self.buckets = [0] * self.BUCKETS
+		self.count = 0
+		self.max = 0
+
+	def add(self, seconds):
+		if not 0 <= seconds < MAX_SAMPLE:
+			return
+		self.buckets[min(int(seconds * 1e6).bit_length(), self.BUCKETS - 1)] += 1
+		self.count += 1
+		if seconds > self.max:
+			self.max = seconds
+
+	def percentile(self, p):
+		if self.count == 0:
+			return None
+		rank = self.count * p / 100.0
+		n = 0
+		for i, c in enumerate(self.buckets):
+			n += c
+			if n >= rank:
+				return min((1 << i) / 1e6, self.max)
+		return self.max
+
+class InstanceStats(object):
+	__slots__ = ('name', 'tick', 'dispatch')
+
+	def __init__(self, name):
+		self.name = name
+		self.tick = TimingStats()
+		self.dispatch = TimingStats()
+
+class Instrumentation(object):
+	# Seconds between publications of the statistics
+	PUBLISH_INTERVAL = 10
+
+	def __init__(self, dbusservice):
+		self._dbusservice = dbusservice
+		self.timer = time.time
+		self.tick = TimingStats()
+		self.dispatch = TimingStats()
+		# Stats of each start/stop instance object
+		self._instances = {}
+		self._lastpublish = None
+		self._add_paths('/Debug')
+
+	def _add_paths(self, prefix, counters=False):
+		for s in ('Tick', 'Dispatch'):
+			for p in ('P50', 'P95', 'Max', 'Count'):
+				self._dbusservice.add_path('%s/%s/%s' % (prefix, s, p), value=None)
+		if counters:
+			for p in ('Evaluations', 'SkippedEvaluations', 'ValueChanges'):
+				self._dbusservice.add_path('%s/%s' % (prefix, p), value=None)
+
+	def _remove_paths(self, prefix, counters=False):
+		for s in ('Tick', 'Dispatch'):
+			for p in ('P50', 'P95', 'Max', 'Count'):
+				del self._dbusservice['%s/%s/%s' % (prefix, s, p)]
+		if counters:
+			for p in ('Evaluations', 'SkippedEvaluations', 'ValueChanges'):
+				del self._dbusservice['%s/%s' % (prefix, p)]
+
+	def add_instance(self, instance, name):
+		# An instance replacing another one with the same name starts over
+		for i, stats in self._instances.items():
+			if stats.name == name:
+				self.remove_instance(i)
+		self._instances[instance] = InstanceStats(name)
+		self._add_paths('/Debug/' + name, counters=True)
+
+	def remove_instance(self, instance):
+		stats = self._instances.pop(instance, None)
+		if stats is not None:
+			self._remove_paths('/Debug/' + stats.name, counters=True)
+
+	def instance_stats(self, instance):
+		return self._instances[instance]
+
+	def handled(self, owner, seconds):
+		# Called by the dispatcher for each handler run
+		stats = self._instances.get(owner)
+		if stats is not None:
+			stats.dispatch.add(seconds)
+
+	def _publish_stats(self, prefix, tick, dispatch):
+		for s, stats in (('Tick', tick), ('Dispatch', dispatch)):
+			for p, value in (('P50', stats.percentile(50)), ('P95', stats.percentile(95)),
+							('Max', stats.max if stats.count else None)):
+				self._dbusservice['%s/%s/%s' % (prefix, s, p)] = \
+					None if value is None else round(value * 1e3, 3)
+			self._dbusservice['%s/%s/Count' % (prefix, s)] = stats.count
+
+	def publish(self, now):
+		# Publishes at most once per PUBLISH_INTERVAL, now in seconds
+		if self._lastpublish is not None and 0 <= now - self._lastpublish < self.PUBLISH_INTERVAL:
+			return
+		self._lastpublish = now
+		self._publish_stats('/Debug', self.tick, self.dispatch)
+		for instance, stats in self._instances.items():
+			prefix = '/Debug/' + stats.name
+			self._publish_stats(prefix, stats.tick, stats.dispatch)
+			self._dbusservice[prefix + '/Evaluations'] = instance.evaluations
+			self._dbusservice[prefix + '/SkippedEvaluations'] = instance.skippedevaluations
+			self._dbusservice[prefix + '/ValueChanges'] = stats.dispatch.count
@@ -31,13 +31,15 @@ __author__ = 'Gavin Beatty <gavinbeatty@gmail.com>'
 __date__ = '2010-01-18'
 
 __all__ = [
-  'timespec', 'get_monotonic_time_impl', 'monotonic_time'
+  'timespec', 'get_monotonic_time_impl', 'monotonic_time',
+  'get_monotonic_seconds_impl', 'monotonic_seconds'
 ]
 
 import ctypes
 import os
 import sys
 import errno
+import time
 
 class timespec(ctypes.Structure):
     _fields_ = [
@@ -47,16 +49,39 @@ class timespec(ctypes.Structure):
     def to_seconds_double(self):
         return self.tv_sec + self.tv_nsec * 1e-9
 
+# Implementations are resolved on first use and reused afterwards
+_monotonic_time_impl = None
+_monotonic_seconds_impl = None
+
 def monotonic_time(impl=None):
+    # Note that the default implementation returns the same timespec on
+    # every call, it is overwritten by the next call.
+    global _monotonic_time_impl
     if impl is None:
-        impl = get_monotonic_time_impl()
+        if _monotonic_time_impl is None:
+            _monotonic_time_impl = get_monotonic_time_impl()
+        impl = _monotonic_time_impl
     return impl()
 
+def monotonic_seconds():
+    global _monotonic_seconds_impl
+    if _monotonic_seconds_impl is None:
+        _monotonic_seconds_impl = get_monotonic_seconds_impl()
+    return _monotonic_seconds_impl()
+
+def get_monotonic_seconds_impl():
+    # Returns a function without arguments giving the monotonic time in
+    # seconds as a float, the one of the time module when there is one.
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    impl = get_monotonic_time_impl()
+    return lambda: impl().to_seconds_double()
+
 def get_monotonic_time_impl():
     if sys.platform.startswith("linux"):
-        return lambda: monotonic_time_unix(1, impl=get_monotonic_time_impl_unix())
+        return monotonic_time_unix_impl(1)
     elif sys.platform.startswith("freebsd"):
-        return lambda: monotonic_time_unix(4, impl=get_monotonic_time_impl_unix())
+        return monotonic_time_unix_impl(4)
     elif sys.platform.startswith("darwin"):
         return lambda: monotonic_time_darwin(impl=get_monotonic_time_impl_darwin())
     elif sys.platform.startswith("win32"):
@@ -88,6 +113,19 @@ def monotonic_time_unix(clock, impl=None):
         raise OSError(errno_, os.strerror(errno_))
     return t
 
+def monotonic_time_unix_impl(clock):
+    # clock_gettime is looked up once and always fills the same timespec,
+    # so getting the time allocates nothing.
+    impl = get_monotonic_time_impl_unix()
+    t = timespec()
+    ref = ctypes.byref(t)
+    def monotonic_time():
+        if impl(clock, ref) != 0:
+            errno_ = ctypes.get_errno()
+            raise OSError(errno_, os.strerror(errno_))
+        return t
+    return monotonic_time
+
 def get_monotonic_time_impl_win32():
     return getattr(ctypes.windll.kernel32, 'GetTickCount64', ctypes.windll.kernel32.GetTickCount)
 def monotonic_time_win32(impl=None):
@@ -0,0 +1,201 @@
+#!/usr/bin/python -u
+# -*- coding: utf-8 -*-
+
+# Recording of the dbus values and settings seen by the Generator
+# The file is append only and binary: a header followed by records, each
+# starting with a type byte. Service names, paths and string values are
+# written once per file as a string definition and referred to by id after
+# that, the other values are packed as they are. Files are rotated by size
+# and when a recorder starts, every file having its own string table, so
+# each one can be read alone.
+#
+# Record layout, little endian:
+#   string:  type, id (H), length (H), utf-8 bytes
+#   value:   type, time (d), service id (H), path id (H), value
+# the value being nothing for None and removed services, a q for integers,
+# a d for floats, a string id (H) for strings and a length (H) followed by
+# the json text for anything else.
+
+import json
+import logging
+import mmap
+import os
+import struct
+
+MAGIC = 'GENREC1\n'
+
+T_STRING = 0
+T_NONE = 1
+T_INT = 2
+T_FLOAT = 3
+T_STR = 4
+T_JSON = 5
+T_REMOVED = 6
+
+_type = struct.Struct('<B')
+_string = struct.Struct('<BHH')
+_head = struct.Struct('<BdHH')
+_int = struct.Struct('<BdHHq')
+_float = struct.Struct('<BdHHd')
+_str = struct.Struct('<BdHHH')
+_json = struct.Struct('<BdHHH')
+
+# Ids are 16 bit, a full string table starts a new file
+MAX_STRINGS = 0xFFFF
+
+class Recorder(object):
+	""" Appends value changes to a recording. Writes go through the file
+	buffer, so a change costs a struct pack and a buffered write. What is
+	still in the buffer is lost when the process dies, flush() writes it. """
+	def __init__(self, path, maxsize=4 * 1024 * 1024, count=3, buffersize=64 * 1024):
+		self._path = path
+		self._maxsize = maxsize
+		# Number of rotated files kept, path.1 being the most recent one
+		self._count = count
+		self._buffersize = buffersize
+		self._file = None
+		self._strings = {}
+		self._size = 0
+		self.records = 0
+		# The string table of a previous recording is not known, nor whether
+		# it ends with a whole record, so each recorder starts a new file
+		if os.path.exists(path) and os.path.getsize(path) > 0:
+			self._shift()
+		self._open()
+
+	def _open(self):
+		self._file = open(self._path, 'wb', self._buffersize)
+		self._strings = {}
+		self._size = 0
+		self._write(MAGIC)
+
+	def _rotate(self):
+		self._file.close()
+		self._shift()
+		self._open()
+
+	def _shift(self):
+		# Moves the current file to path.1, the older ones one number up
+		for n in range(self._count - 1, 0, -1):
+			src = '%s.%d' % (self._path, n)
+			if os.path.exists(src):
+				os.rename(src, '%s.%d' % (self._path, n + 1))
+		if self._count > 0:
+			os.rename(self._path, self._path + '.1')
+		else:
+			os.remove(self._path)
+
+	def _write(self, data):
+		self._file.write(data)
+		self._size += len(data)
+
+	def _id(self, s):
+		# Id of a string, defined in the file the first time it is used
+		try:
+			return self._strings[s]
+		except KeyError:
+			pass
+		i = len(self._strings)
+		data = s.encode('utf-8') if isinstance(s, unicode) else s
+		self._write(_string.pack(T_STRING, i, len(data)) + data)
+		self._strings[s] = i
+		return i
+
+	def record(self, t, service, path, value):
+		if self._size >= self._maxsize or len(self._strings) >= MAX_STRINGS - 3:
+			self._rotate()
+		self.records += 1
+		s = self._id(service)
+		p = self._id(path)
+		# bool and the dbus types are subclasses of these
+		if value is None:
+			self._write(_head.pack(T_NONE, t, s, p))
+		elif isinstance(value, (int, long)) and -0x8000000000000000 <= value <= 0x7FFFFFFFFFFFFFFF:
+			self._write(_int.pack(T_INT, t, s, p, value))
+		elif isinstance(value, float):
+			self._write(_float.pack(T_FLOAT, t, s, p, value))
+		elif isinstance(value, basestring):
+			self._write(_str.pack(T_STR, t, s, p, self._id(value)))
+		else:
+			try:
+				data = json.dumps(value)
+			except (TypeError, ValueError):
+				logging.warning('Not recording %s%s, unsupported value' % (service, path))
+				return
+			self._write(_json.pack(T_JSON, t, s, p, len(data)) + data)
+
+	def removed(self, t, service):
+		if self._size >= self._maxsize:
+			self._rotate()
+		self.records += 1
+		self._write(_head.pack(T_REMOVED, t, self._id(service), 0))
+
+	def flush(self):
+		self._file.flush()
+
+	def close(self):
+		self._file.close()
+
+def read(path):
+	""" Yields the records of a recording as (time, service, path, value),
+	path and value being None for a removed service. The file is memory
+	mapped and decoded while iterating, a record cut short at the end, left
+	by a process that died while writing, ends the iteration. """
+	with open(path, 'rb') as f:
+		if os.fstat(f.fileno()).st_size <= len(MAGIC):
+			return
+		m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	try:
+		if m[:len(MAGIC)] != MAGIC:
+			raise ValueError('%s is not a recording' % path)
+		for record in _decode(m, len(MAGIC)):
+			yield record
+	finally:
+		m.close()
+
+def _decode(m, offset):
+	strings = []
+	size = len(m)
+	while offset < size:
+		t = ord(m[offset])
+		try:
+			if t == T_STRING:
+				t, i, length = _string.unpack_from(m, offset)
+				offset += _string.size
+				if offset + length > size:
+					return
+				strings.append(m[offset:offset + length].decode('utf-8'))
+				offset += length
+				continue
+			if t in (T_NONE, T_REMOVED):
+				t, time, s, p = _head.unpack_from(m, offset)
+				offset += _head.size
+				if t == T_REMOVED:
+					yield time, strings[s], None, None
+				else:
+					yield time, strings[s], strings[p], None
+			elif t == T_INT:
+				t, time, s, p, value = _int.unpack_from(m, offset)
+				offset += _int.size
+				yield time, strings[s], strings[p], value
+			elif t == T_FLOAT:
+				t, time, s, p, value = _float.unpack_from(m, offset)
+				offset += _float.size
+				yield time, strings[s], strings[p], value
+			elif t == T_STR:
+				t, time, s, p, v = _str.unpack_from(m, offset)
+				offset += _str.size
+				yield time, strings[s], strings[p], strings[v]
+			elif t == T_JSON:
+				t, time, s, p, length = _json.unpack_from(m, offset)
+				offset += _json.size
+				if offset + length > size:
+					return
+				value = json.loads(m[offset:offset + length])
+				offset += length
+				yield time, strings[s], strings[p], value
+			else:
+				raise ValueError('Unknown record type %d at %d' % (t, offset))
+		except struct.error:
+			# Truncated record
+			return
@@ -7,7 +7,8 @@ import dbus
 from gen_utils import dummy
 
 remoteprefix = 'com.victronenergy.system'
-name = "Generator0"
+# Instances are named prefix + number: Generator0, Generator1...
+prefix = "Generator"
 # List of the service/paths we need to monitor
 monitoring = {
 	'com.victronenergy.settings': {
@@ -25,12 +26,13 @@ def check_device(dbusmonitor, dbuspath):
 	# return false.
 	return False
 
-def create(dbusmonitor, dbusservice, remoteservice, settings):
+def create(dbusmonitor, dbusservice, remoteservice, settings, clock, serviceindex, phases, wakeup, name):
 	i = RelayGenerator()
-	i.set_sources(dbusmonitor, dbusservice, settings, name, remoteservice)
+	i.set_sources(dbusmonitor, dbusservice, settings, name, remoteservice, clock, serviceindex, phases, wakeup)
 	return i
 
 class RelayGenerator(StartStop):
+	remote_inputs = ('/Relay/0/State',)
 
 	def _remote_setup(self):
 		self.enable()
@@ -0,0 +1,230 @@
+#!/usr/bin/python -u
+# -*- coding: utf-8 -*-
+
+# Offline replay of recorded dbus values
+# Feeds a recorded trace to the Generator without dbus and on a virtual clock,
+# ticking like the mainloop would but as fast as possible. The start/stop
+# instances are the real ones (built-in relay, Fischer Panda), only the dbus
+# monitor, service and settings are replaced by the velib mocks.
+#
+# Trace format: a json array per line, [time, service, path, value], ordered
+# by time, time being the unix time of the change. The first records of a
+# service add it, with all its records of the same time, and a null path
+# removes it. Records of com.victronenergy.settings for the generator
+# settings, /Settings/Generator0/..., change those. Recordings made by
+# dbus_generator.py --record are read as well.
+#
+# Usage: replay.py trace.json --set /Settings/Generator0/Soc/Enabled=1
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'ext', 'velib_python'))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'ext', 'velib_python', 'test'))
+from mock_dbus_monitor import MockDbusMonitor
+from mock_dbus_service import MockDbusService
+from mock_settings_device import MockSettingsDevice
+import dbus_generator
+from clock import VirtualClock
+from gen_utils import States
+import recorder
+
+class ReplayGenerator(dbus_generator.Generator):
+	def __init__(self, clock):
+		self._replayclock = clock
+		# Interval of the next tick in ms, set by the Generator
+		self.tickinterval = None
+		self.servicetypes = ()
+		dbus_generator.Generator.__init__(self)
+
+	def _create_clock(self):
+		return self._replayclock
+
+	def _create_dbus_monitor(self, tree, *args, **kwargs):
+		self.servicetypes = tuple(tree.keys())
+		return MockDbusMonitor(tree, *args, checkPaths=False, **kwargs)
+
+	def _create_settings(self, *args, **kwargs):
+		return MockSettingsDevice(*args, **kwargs)
+
+	def _create_dbus_service(self):
+		return MockDbusService('com.victronenergy.generator.startstop0')
+
+	def _schedule_tick(self, interval):
+		self.tickinterval = interval
+
+	def _cancel_tick(self):
+		pass
+
+	def set_setting(self, path, value):
+		# False if it is not a setting of a known instance
+		for settings in set([self._settings] + self._instancesettings.values()):
+			setting = settings.get_short_name(path)
+			if setting is not None:
+				settings[setting] = value
+				return True
+		return False
+
+	def has_service(self, service):
+		return service in self._dbusmonitor.get_service_list()
+
+	def set_value(self, service, path, value):
+		# Change a value of a known service, a None path removes the service
+		if path is None:
+			if self.has_service(service):
+				self._dbusmonitor.remove_service(service)
+		elif self._dbusmonitor.set_value(service, path, value) != 0:
+			self._dbusmonitor.add_value(service, path, value)
+			self._dbus_value_changed(service, path, None, None, None)
+
+	def add_service(self, service, values):
+		values.setdefault('/Connected', 1)
+		values.setdefault('/DeviceInstance', 0)
+		self._dbusmonitor.add_service(service, values)
+
+	def states(self):
+		# (name, state, condition) of the enabled instances
+		service = self._dbusservice
+		for name in sorted(self._names.values()):
+			if '/%s/State' % name in service:
+				yield (name, service['/%s/State' % name],
+					service['/%s/RunningByCondition' % name])
+
+statenames = {
+	States.STOPPED: 'stopped',
+	States.RUNNING: 'running',
+	States.ERROR: 'error'
+	}
+
+def read_trace(f):
+	for line in f:
+		line = line.strip()
+		if line and not line.startswith('#'):
+			yield json.loads(line)
+
+def group_by_time(records):
+	group = []
+	for record in records:
+		if group and record[0] != group[0][0]:
+			yield group[0][0], group
+			group = []
+		group.append(record)
+	if group:
+		yield group[0][0], group
+
+def parse_setting(s):
+	path, value = s.split('=', 1)
+	try:
+		return path, json.loads(value)
+	except ValueError:
+		return path, value
+
+class Replay(object):
+	def __init__(self, records, settings, out=sys.stdout):
+		self._trace = group_by_time(records)
+		self._settings = settings
+		self._out = out
+		self._generator = None
+		self._clock = None
+		self._nexttick = None
+		# Last state of each instance and when it changed to it
+		self._states = {}
+		self.starts = {}
+		self.runtime = {}
+		self.ticks = 0
+
+	def _apply(self, records):
+		# Services seen for the first time are added with all their values
+		generator = self._generator
+		added = {}
+		for t, service, path, value in records:
+			if service == 'com.victronenergy.settings' and generator.set_setting(path, value):
+				continue
+			if not service.startswith(generator.servicetypes):
+				continue
+			if path is not None and not generator.has_service(service):
+				added.setdefault(service, {})[path] = value
+			else:
+				generator.set_value(service, path, value)
+		for service, values in added.items():
+			generator.add_service(service, values)
+
+	def _tick(self, until):
+		while self._nexttick <= until:
+			self._clock.set_time(self._nexttick)
+			self._generator._handletimertick()
+			self.ticks += 1
+			self._check_states()
+			self._nexttick += self._generator.tickinterval / 1000.0
+
+	def _check_states(self):
+		now = self._clock.time()
+		for name, state, condition in self._generator.states():
+			previous = self._states.get(name, (States.STOPPED, now))
+			if state == previous[0]:
+				continue
+			self._states[name] = (state, now)
+			if state == States.RUNNING:
+				self.starts[name] = self.starts.get(name, 0) + 1
+			elif previous[0] == States.RUNNING:
+				self.runtime[name] = self.runtime.get(name, 0) + now - previous[1]
+			self._out.write('%s %-14s %-8s %s\n' % (
+				datetime.datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S'),
+				name, statenames.get(state, state), condition))
+
+	def run(self):
+		for t, records in self._trace:
+			if self._generator is None:
+				self._clock = VirtualClock(t)
+				self._generator = ReplayGenerator(self._clock)
+				self._apply(records)
+				for path, value in self._settings:
+					if not self._generator.set_setting(path, value):
+						logging.warning('Unknown setting %s' % path)
+				self._nexttick = t + self._generator.tickinterval / 1000.0
+				continue
+			self._tick(t)
+			self._clock.set_time(t)
+			self._apply(records)
+			# A change may wake the generator up earlier
+			self._nexttick = min(self._nexttick, t + self._generator.tickinterval / 1000.0)
+		if self._generator is None:
+			return
+		# Generators still running at the end of the trace
+		now = self._clock.time()
+		for name, (state, since) in self._states.items():
+			if state == States.RUNNING:
+				self.runtime[name] = self.runtime.get(name, 0) + now - since
+
+	def summary(self):
+		self._out.write('%d ticks\n' % self.ticks)
+		for name in sorted(set(self.starts.keys()) | set(self.runtime.keys())):
+			self._out.write('%-14s %5d starts %10.2f hours\n' % (
+				name, self.starts.get(name, 0), self.runtime.get(name, 0) / 3600.0))
+
+def main():
+	parser = argparse.ArgumentParser(description='Replay recorded dbus values on the generator start/stop')
+	parser.add_argument('trace', help='trace or recording file, - for a trace on stdin')
+	parser.add_argument('-s', '--set', action='append', default=[], metavar='PATH=VALUE',
+						help='change a generator setting after loading the initial values')
+	parser.add_argument('-d', '--debug', action='store_true', help='log the start/stop messages')
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.INFO if args.debug else logging.WARNING)
+
+	if args.trace == '-':
+		records = read_trace(sys.stdin)
+	else:
+		with open(args.trace, 'rb') as f:
+			isrecording = f.read(len(recorder.MAGIC)) == recorder.MAGIC
+		records = recorder.read(args.trace) if isrecording else read_trace(open(args.trace))
+	replay = Replay(records, [parse_setting(s) for s in args.set])
+	replay.run()
+	replay.summary()
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python -u
+# -*- coding: utf-8 -*-
+
+# Deadline scheduler used by the start/stop instances for all the countdowns:
+# condition start/stop timers, manual start timer and the wall clock events
+# (new day, quiet hours, test run). Deadlines are kept in a min-heap on the
+# monotonic clock, so the mainloop can sleep until the first one expires.
+
+import heapq
+
+# Entry fields
+DEADLINE, SEQUENCE, KEY, CALLBACK, ARGS, START = range(6)
+
+class DeadlineScheduler:
+	def __init__(self, clock):
+		# clock returns monotonic time in seconds
+		self._clock = clock
+		self._queue = []
+		self._entries = {}
+		self._sequence = 0
+
+	def _push(self, key, start, delay, callback, args):
+		# Sequence avoids comparing the rest of the entry for equal deadlines
+		entry = [start + delay, self._sequence, key, callback, args, start]
+		self._sequence += 1
+		self._entries[key] = entry
+		heapq.heappush(self._queue, entry)
+
+	def schedule(self, key, delay, callback, *args):
+		# Call callback(*args) delay seconds from now, replaces a pending
+		# deadline with the same key.
+		self.cancel(key)
+		self._push(key, self._clock(), delay, callback, args)
+
+	def reschedule(self, key, delay):
+		# Change the delay of a pending deadline, counting from the moment it
+		# was scheduled.
+		entry = self._entries.get(key)
+		if entry is None:
+			return
+		start, callback, args = entry[START], entry[CALLBACK], entry[ARGS]
+		self.cancel(key)
+		self._push(key, start, delay, callback, args)
+
+	def cancel(self, key):
+		entry = self._entries.pop(key, None)
+		if entry is not None:
+			# Lazy deletion, the entry is dropped when it reaches the top
+			entry[CALLBACK] = None
+
+	def clear(self):
+		self._queue = []
+		self._entries = {}
+
+	def pending(self, key):
+		return key in self._entries
+
+	def remaining(self, key):
+		entry = self._entries.get(key)
+		if entry is None:
+			return 0
+		return max(0, entry[DEADLINE] - self._clock())
+
+	def next_deadline(self):
+		queue = self._queue
+		while queue and queue[0][CALLBACK] is None:
+			heapq.heappop(queue)
+		return queue[0][DEADLINE] if queue else None
+
+	def run(self):
+		# Fire the callbacks of all the expired deadlines
+		now = self._clock()
+		while self._queue and self._queue[0][DEADLINE] <= now:
+			entry = heapq.heappop(self._queue)
+			if entry[CALLBACK] is None:
+				continue
+			del self._entries[entry[KEY]]
+			entry[CALLBACK](*entry[ARGS])
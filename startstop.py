@@ -11,27 +11,57 @@
 
 import dbus
 import datetime
-import calendar
-import time
 import sys
-import json
 import os
 import logging
-from os import environ
-import monotonic_time
-from gen_utils import DBusServicePrefix, SettingsPrefix, Errors, States
+import math
+from scheduler import DeadlineScheduler
+from history import RuntimeHistory, RuntimePersistence
+from gen_utils import DBusServicePrefix, SettingsView, Errors, States
+import conditions
 # Victron packages
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'ext', 'velib_python'))
 from ve_utils import exit_on_error
 from settingsdevice import SettingsDevice
 
+class TestRunPlan(object):
+	# Test run window, valid between two wall times. Nothing in it changes
+	# before validuntil, it is only computed again after that or when a
+	# test run setting or the timezone changes.
+	__slots__ = ('validfrom', 'validuntil', 'valid', 'future', 'due', 'start', 'stop', 'nextrun')
+
+	def __init__(self, now):
+		self.validfrom = now
+		self.validuntil = float('inf')
+		# False for invalid dates
+		self.valid = True
+		# The start date is still to come
+		self.future = False
+		# The window is on a test run day
+		self.due = False
+		self.start = None
+		self.stop = None
+		self.nextrun = None
+
 class StartStop:
+	# Paths of the remote service read on each evaluation
+	remote_inputs = ()
 
 	def __init__(self):
 
 		self._dbusservice = None
 		self._settings = None
 		self._dbusmonitor = None
+		self._clock = None
+		# Reading of the clock of the current cycle, see _read_clock()
+		self._now = None
+		self._serviceindex = None
+		# Sums and maximums of the per phase values, shared PhaseAggregates
+		self._phases = None
+		# Called when a change needs an evaluation sooner than the idle tick
+		self._wakeup = None
+		# Conditions the inputs are monitored for
+		self._subscribed = ()
 		self._remoteservice = None
 		self._name = None
 		self._enabled = False
@@ -39,9 +69,14 @@ class StartStop:
 		self._system_service = 'com.victronenergy.system'
 
 		self.HISTORY_DAYS = 30
+		self._history = RuntimeHistory(self.HISTORY_DAYS)
+		self._counters = None
 		# One second per retry
 		self.RETRIES_ON_ERROR = 300
 		self._testrun_soc_retries = 0
+		self._testrunplan = None
+		# Local day index, kept up to date by day_changed()
+		self._day = None
 		self._last_counters_check = 0
 
 		self._starttime = 0
@@ -50,110 +85,66 @@ class StartStop:
 		self._timer_runnning = 0
 		self._battery_service = None
 		self._battery_prefix = None
+		self._battery_voltage_path = '/Voltage'
+		self._battery_current_path = '/Current'
 		self._vebusservice = None
 		self._errorstate = 0
+		self._quiethours = False
+		# Quiet hours state, valid from/until these wall times. It is only
+		# computed again outside of them, see _schedule_quiet_hours().
+		self._quiethoursactive = False
+		self._quiethoursfrom = 0
+		self._quiethoursuntil = 0
+		# Evaluation is only done when something changed, when a deadline
+		# expires or when the generator needs a tick based evaluation
+		self._evaluation_needed = True
+		# Ticks that evaluated the conditions and ticks that had nothing to do
+		self.evaluations = 0
+		self.skippedevaluations = 0
+		# Owns all the countdowns: condition timers, manual start timer
+		# and the wall clock deadlines
+		self._scheduler = DeadlineScheduler(self._get_monotonic_seconds)
 
 		self._acpower_inverter_input = {
 			'timeout': 0,
 			'unabletostart': False
 			}
 
-		self._condition_stack = {
-			'batteryvoltage': {
-				'name': 'batteryvoltage',
-				'reached': False,
-				'boolean': False,
-				'timed': True,
-				'start_timer': 0,
-				'stop_timer': 0,
-				'valid': True,
-				'enabled': False,
-				'retries': 0,
-				'monitoring': 'battery'
-			},
-			'batterycurrent': {
-				'name': 'batterycurrent',
-				'reached': False,
-				'boolean': False,
-				'timed': True,
-				'start_timer': 0,
-				'stop_timer': 0,
-				'valid': True,
-				'enabled': False,
-				'retries': 0,
-				'monitoring': 'battery'
-			},
-			'acload': {
-				'name': 'acload',
-				'reached': False,
-				'boolean': False,
-				'timed': True,
-				'start_timer': 0,
-				'stop_timer': 0,
-				'valid': True,
-				'enabled': False,
-				'retries': 0,
-				'monitoring': 'vebus'
-			},
-			'inverterhightemp': {
-				'name': 'inverterhightemp',
-				'reached': False,
-				'boolean': True,
-				'timed': True,
-				'start_timer': 0,
-				'stop_timer': 0,
-				'valid': True,
-				'enabled': False,
-				'retries': 0,
-				'monitoring': 'vebus'
-			},
-			'inverteroverload': {
-				'name': 'inverteroverload',
-				'reached': False,
-				'boolean': True,
-				'timed': True,
-				'start_timer': 0,
-				'stop_timer': 0,
-				'valid': True,
-				'enabled': False,
-				'retries': 0,
-				'monitoring': 'vebus'
-			},
-			'soc': {
-				'name': 'soc',
-				'reached': False,
-				'boolean': False,
-				'timed': False,
-				'valid': True,
-				'enabled': False,
-				'retries': 0,
-				'monitoring': 'battery'
-			},
-			'stoponac1': {
-				'name': 'stoponac1',
-				'reached': False,
-				'boolean': True,
-				'timed': False,
-				'valid': True,
-				'enabled': False,
-				'retries': 0,
-				'monitoring': 'vebus'
-			}
-		}
+		# Conditions will be evaluated in this order
+		self._conditions = [cls() for cls in conditions.registry]
 
-	def set_sources(self, dbusmonitor, dbusservice, settings, name, remoteservice):
+	def set_sources(self, dbusmonitor, dbusservice, settings, name, remoteservice, clock, serviceindex, phases, wakeup):
 		self._dbusservice = DBusServicePrefix(dbusservice, name)
-		self._settings = SettingsPrefix(settings, name)
+		self._settings = SettingsView(settings, name)
 		self._dbusmonitor = dbusmonitor
+		self._clock = clock
+		self._read_clock()
+		self._serviceindex = serviceindex
+		self._phases = phases
+		self._wakeup = wakeup
 		self._remoteservice = remoteservice
 		self._name = name
-		# Set timezone to user selected timezone
-		tz = self._dbusmonitor.get_value('com.victronenergy.settings', '/Settings/System/TimeZone')
-		environ['TZ'] = tz if tz else 'UTC'
+		self._bind_condition_settings()
+		self._day = self._now.day
+		self._history.load(self._day, self._settings.accumulateddaily)
+		self._counters = RuntimePersistence(self._settings, self._history)
 
 		self.log_info('Start/stop instance created for %s.' % self._remoteservice)
 		self._remote_setup()
 
+	def _bind_condition_settings(self):
+		for condition in self._conditions:
+			name = condition.name
+			settings = condition.settings
+			self._settings.bind(settings, 'enabled', name + 'enabled')
+			if not condition.boolean:
+				for s in ('start', 'stop'):
+					self._settings.bind(settings, s, name + s)
+					self._settings.bind(settings, 'qh_' + s, 'qh_' + name + s)
+			if condition.timed:
+				for s in ('starttimer', 'stoptimer'):
+					self._settings.bind(settings, s, name + s)
+
 	def _create_paths(self):
 		# State: None = invalid, 0 = stopped, 1 = running
 		self._dbusservice.add_path('/State', value=None)
@@ -172,9 +163,11 @@ class StartStop:
 		# Next test run is needed 1, not needed 0
 		self._dbusservice.add_path('/SkipTestRun', value=None)
 		# Manual start
-		self._dbusservice.add_path('/ManualStart', value=None, writeable=True)
+		self._dbusservice.add_path('/ManualStart', value=None, writeable=True,
+								onchangecallback=self._manual_start_changed)
 		# Manual start timer
-		self._dbusservice.add_path('/ManualStartTimer', value=None, writeable=True)
+		self._dbusservice.add_path('/ManualStartTimer', value=None, writeable=True,
+								onchangecallback=self._manual_start_changed)
 		# Silent mode active
 		self._dbusservice.add_path('/QuietHours', value=None)
 		# Alarms
@@ -188,7 +181,7 @@ class StartStop:
 		self._dbusservice['/RunningByCondition'] = ''
 		self._dbusservice['/Runtime'] = 0
 		self._dbusservice['/TodayRuntime'] = 0
-		self._dbusservice['/TestRunIntervalRuntime'] = self._interval_runtime(self._settings['testruninterval'])
+		self._dbusservice['/TestRunIntervalRuntime'] = self._interval_runtime(self._settings.testruninterval)
 		self._dbusservice['/NextTestRun'] = None
 		self._dbusservice['/SkipTestRun'] = None
 		self._dbusservice['/ManualStart'] = 0
@@ -202,22 +195,39 @@ class StartStop:
 		if self._enabled:
 			return
 		self.log_info('Enabling auto start/stop and taking control of remote switch')
+		self._read_clock()
 		self._create_paths()
+		self._quiethours = False
+		self._quiethoursuntil = 0
+		self._testrunplan = None
 		self._determineservices()
 		self._update_remote_switch()
+		self._evaluation_needed = True
 		self._enabled = True
 
 	def disable(self):
 		if not self._enabled:
 			return
 		self.log_info('Disabling auto start/stop, releasing control of remote switch')
-		self._remove_paths()
 		self._enabled = False
+		self._remove_paths()
+		self._flush_counters()
+		self._scheduler.clear()
 
 	def remove(self):
 		self.disable()
 		self.log_info('Removed from start/stop instances')
 
+	def flush(self):
+		# Saves the runtime counters not written yet, called before another
+		# instance replaces this one without removing it
+		if not self._enabled:
+			return
+		if self._dbusservice['/State'] == States.RUNNING:
+			self._dbusservice['/Runtime'] = int(self._get_monotonic_seconds() - self._starttime)
+			self._update_accumulated_time()
+		self._flush_counters()
+
 	def _remove_paths(self):
 		self._dbusservice.__delitem__('/State')
 		self._dbusservice.__delitem__('/Error')
@@ -234,9 +244,11 @@ class StartStop:
 
 	def device_added(self, dbusservicename, instance):
 		self._determineservices()
+		self._evaluation_needed = True
 
 	def device_removed(self, dbusservicename, instance):
 		self._determineservices()
+		self._evaluation_needed = True
 
 	def get_error(self):
 		return self._dbusservice['/Error']
@@ -247,42 +259,117 @@ class StartStop:
 	def clear_error(self):
 		self._dbusservice['/Error'] = Errors.NONE
 
-	def dbus_value_changed(self, dbusServiceName, dbusPath, options, changes, deviceInstance):
-		if self._dbusservice is None:
-			return
-		if dbusPath == '/AutoSelectedBatteryMeasurement' and self._settings['batterymeasurement'] == 'default':
+	def dbus_value_handlers(self):
+		# (service prefix, path, handler) of the dbus value changes
+		# this instance must be notified of
+		handlers = [
+			(self._system_service, '/AutoSelectedBatteryMeasurement', self._autoselected_battery_changed),
+			(self._system_service, '/VebusService', self._vebusservice_changed),
+			('com.victronenergy.settings', '/Settings/System/TimeZone', self._timezone_changed)
+			]
+		# Paths read by the enabled conditions, a change on any of them on the
+		# service in use triggers a new evaluation of the start/stop conditions.
+		# The generator detection reads the AC input state and source.
+		self._subscribed = self._get_subscribed_conditions()
+		enabled = [c for c in self._conditions if c.name in self._subscribed]
+		battery_inputs = conditions.get_inputs('battery', enabled)
+		if 'testrun' in self._subscribed and '/Soc' not in battery_inputs:
+			battery_inputs += ('/Soc',)
+		vebus_inputs = conditions.get_inputs('vebus', enabled)
+		if '/Ac/ActiveIn/Connected' not in vebus_inputs:
+			vebus_inputs += ('/Ac/ActiveIn/Connected',)
+		inputs = [('com.victronenergy.battery', battery_inputs),
+				# A vebus device can be the battery monitor too
+				('com.victronenergy.vebus', battery_inputs + vebus_inputs),
+				(self._system_service, conditions.get_inputs('system', enabled) + ('/Ac/ActiveIn/Source',)),
+				(self._remoteservice, self.remote_inputs)]
+		for serviceprefix, paths in inputs:
+			handlers.extend((serviceprefix, path, self._input_changed) for path in paths)
+		return handlers
+
+	def _get_subscribed_conditions(self):
+		# Conditions whose inputs must be monitored
+		subscribed = tuple(c.name for c in self._conditions if c.settings.enabled == 1)
+		if self._settings.testrunenabled == 1:
+			subscribed += ('testrun',)
+		return subscribed
+
+	def phase_measurements(self):
+		# Per phase measurements read by the enabled conditions
+		return conditions.get_measurements(c for c in self._conditions if c.name in self._subscribed)
+
+	def subscriptions_changed(self):
+		# True when the value change handlers must be registered again
+		return self._get_subscribed_conditions() != self._subscribed
+
+	def _input_changed(self, dbusServiceName, dbusPath, options, changes, deviceInstance):
+		if dbusServiceName in (self._battery_service, self._vebusservice,
+								self._system_service, self._remoteservice):
+			self._evaluation_needed = True
+
+	def _autoselected_battery_changed(self, dbusServiceName, dbusPath, options, changes, deviceInstance):
+		if self._settings.batterymeasurement == 'default':
 			self._determineservices()
+			self._evaluation_needed = True
 
-		if dbusPath == '/VebusService':
-			self._determineservices()
+	def _vebusservice_changed(self, dbusServiceName, dbusPath, options, changes, deviceInstance):
+		self._determineservices()
+		self._evaluation_needed = True
 
-		# Update env timezone when setting changes
-		if dbusPath == '/Settings/System/TimeZone':
-			environ['TZ'] = changes['Value'] if changes['Value'] else 'UTC'
+	def _timezone_changed(self, dbusServiceName, dbusPath, options, changes, deviceInstance):
+		# The timezone is applied to the clock by the Generator, the local
+		# times computed for it are not valid anymore
+		self._quiethoursuntil = 0
+		self._testrunplan = None
+		self._evaluation_needed = True
 
 	def handlechangedsetting(self, setting, oldvalue, newvalue):
 		if self._dbusservice is None:
 			return
-		if self._name not in setting:
+		if not setting.endswith(self._name):
 			# Not our setting
 			return
 
+		self._read_clock()
+		self._settings.update(setting, newvalue)
 		s = self._settings.removeprefix(setting)
+		# Runtime counters are written by the instance itself
+		if s not in ('accumulateddaily', 'accumulatedtotal'):
+			self._evaluation_needed = True
+
+		if s == 'accumulateddaily' and newvalue != self._counters.json:
+			# Changed by someone else
+			self._history.load(self._day, newvalue)
+			if self._enabled:
+				self._dbusservice['/TodayRuntime'] = self._interval_runtime(0)
+				self._dbusservice['/TestRunIntervalRuntime'] = self._interval_runtime(self._settings.testruninterval)
+
+		if s.startswith('quiethours'):
+			self._quiethoursuntil = 0
+
+		if s.startswith('testrun'):
+			self._testrunplan = None
 
 		if s == 'batterymeasurement':
 			self._determineservices()
 			# Reset retries and valid if service changes
-			for condition in self._condition_stack:
-				if self._condition_stack[condition]['monitoring'] == 'battery':
-					self._condition_stack[condition]['valid'] = True
-					self._condition_stack[condition]['retries'] = 0
+			for condition in self._conditions:
+				if condition.monitoring == 'battery':
+					condition.valid = True
+					condition.retries = 0
+
+		# Timers already running count the new value from the moment they started
+		for condition in self._conditions:
+			for timer in ('start', 'stop'):
+				if s == condition.name + timer + 'timer':
+					self._scheduler.reschedule((condition.name, timer), newvalue)
 
 		if s == 'autostart':
 				self.log_info('Autostart function %s.' % ('enabled' if newvalue == 1 else 'disabled'))
 
 		if self._dbusservice is not None and s == 'testruninterval':
 			self._dbusservice['/TestRunIntervalRuntime'] = self._interval_runtime(
-															self._settings['testruninterval'])
+															self._settings.testruninterval)
 
 	def dbus_name_owner_changed(self, name, oldowner, newowner):
 		self._determineservices()
@@ -306,14 +393,89 @@ class StartStop:
 	def log_info(self, msg):
 		logging.info(self._name + ': %s' % msg)
 
-	def tick(self):
+	def tick(self, snapshot, now):
+		# now is the ClockReading of the cycle, shared by all the instances
 		if not self._enabled:
 			return
-		self._check_remote_status()
-		self._evaluate_startstop_conditions()
-		self._detect_generator_at_acinput()
-
-	def _evaluate_startstop_conditions(self):
+		self._now = now
+		# Paths written during the tick are published at the end of it
+		self._dbusservice.begin()
+		try:
+			# Expired deadlines request a new evaluation
+			self._scheduler.run()
+			if not self._evaluation_pending():
+				self.skippedevaluations += 1
+				return
+			self._evaluation_needed = False
+			self.evaluations += 1
+			self._check_remote_status()
+			self._evaluate_startstop_conditions(snapshot)
+			self._detect_generator_at_acinput(snapshot)
+			self._scheduler.schedule('wakeup', max(0, self._get_next_deadline() - now.time),
+									self._deadline_expired)
+		finally:
+			self._dbusservice.commit()
+
+	def day_changed(self, now):
+		# First tick of a new local day
+		self._day = now.day
+		self._evaluation_needed = True
+
+	def next_deadline(self):
+		# Seconds till the first deadline of this instance, None if there is none
+		if not self._enabled:
+			return None
+		deadline = self._scheduler.next_deadline()
+		if deadline is None:
+			return None
+		return max(0, deadline - self._get_monotonic_seconds())
+
+	def tick_interval(self, active):
+		# Longest time in ms till the next tick, None when disabled: active,
+		# in ms, while running, counting down or with an evaluation pending,
+		# longer when idle. Changes of the monitored values wake the
+		# mainloop up anyway.
+		if not self._enabled:
+			return None
+		if self._timer_runnning or self._evaluation_pending():
+			return active
+		return max(active, self._settings.idletickinterval * 1000)
+
+	def _deadline_expired(self):
+		self._evaluation_needed = True
+
+	def _evaluation_pending(self):
+		if self._evaluation_needed or self._dbusservice['/ManualStart'] != 0:
+			return True
+		# Runtime counters and retries are tick based
+		if self._dbusservice['/State'] != States.STOPPED or self._errorstate:
+			return True
+		for condition in self._conditions:
+			if condition.enabled and condition.valid and condition.retries > 0:
+				return True
+		return False
+
+	def _get_next_deadline(self):
+		# Wall clock time at which the conditions must be evaluated again
+		# even if none of the inputs changes: new day, quiet hours start/end,
+		# end of the test run plan and test run start.
+		now = self._now.time
+		deadlines = [self._now.nextmidnight]
+
+		if self._quiethoursuntil > now:
+			deadlines.append(self._quiethoursuntil)
+
+		plan = self._testrunplan
+		if plan is not None and plan.validuntil > now:
+			deadlines.append(plan.validuntil)
+
+		nexttestrun = self._dbusservice['/NextTestRun']
+		if nexttestrun is not None and nexttestrun > now:
+			deadlines.append(nexttestrun)
+
+		return min(deadlines)
+
+	def _evaluate_startstop_conditions(self, snapshot):
 		if self.get_error() != Errors.NONE:
 			# First evaluation after an error, log it
 			if self._errorstate == 0:
@@ -327,28 +489,26 @@ class StartStop:
 			self._errorstate = 0
 			self.log_info('Error state cleared, taking control of remote switch.')
 
-		# Conditions will be evaluated in this order
-		conditions = ['soc', 'acload', 'batterycurrent', 'batteryvoltage', 'inverterhightemp', 'inverteroverload', 'stoponac1']
 		start = False
 		startbycondition = None
 		activecondition = self._dbusservice['/RunningByCondition']
-		today = calendar.timegm(datetime.date.today().timetuple())
 		self._timer_runnning = False
-		values = self._get_updated_values()
+		get_value = snapshot.get_value
 		connection_lost = False
+		inhibit = False
 
 		self._check_quiet_hours()
 
 		# New day, register it
-		if self._last_counters_check < today and self._dbusservice['/State'] == States.STOPPED:
-			self._last_counters_check = today
+		if self._last_counters_check < self._day and self._dbusservice['/State'] == States.STOPPED:
+			self._last_counters_check = self._day
 			self._update_accumulated_time()
 
 		# Update current and accumulated runtime.
 		# By performance reasons, accumulated runtime is only updated
 		# once per 60s. When the generator stops is also updated.
 		if self._dbusservice['/State'] == States.RUNNING:
-			mtime = monotonic_time.monotonic_time().to_seconds_double()
+			mtime = self._now.monotonic
 			if (mtime - self._starttime) - self._last_runtime_update >= 60:
 				self._dbusservice['/Runtime'] = int(mtime - self._starttime)
 				self._update_accumulated_time()
@@ -361,22 +521,29 @@ class StartStop:
 			start = True
 
 		# Conditions will only be evaluated if the autostart functionality is enabled
-		if self._settings['autostart'] == 1:
+		if self._settings.autostart == 1:
 
-			if self._evaluate_testrun_condition():
+			soc = get_value(self._battery_service or '', '/Soc')
+			if self._evaluate_testrun_condition(soc):
 				startbycondition = 'testrun'
 				start = True
 
 			# Evaluate value conditions
-			for condition in conditions:
-				start = self._evaluate_condition(self._condition_stack[condition], values[condition]) or start
-				startbycondition = condition if start and startbycondition is None else startbycondition
+			for condition in self._conditions:
+				# Inputs of disabled conditions are not read
+				value = condition.value(self, get_value) if condition.settings.enabled == 1 else None
+				reached = self._evaluate_condition(condition, value)
+				if condition.inhibit:
+					inhibit = inhibit or condition.reached
+				else:
+					start = reached or start
+					startbycondition = condition.name if start and startbycondition is None else startbycondition
 				# Connection lost is set to true if the number of retries of one or more enabled conditions
 				# >= RETRIES_ON_ERROR
-				if self._condition_stack[condition]['enabled']:
-					connection_lost = self._condition_stack[condition]['retries'] >= self.RETRIES_ON_ERROR
+				if condition.enabled:
+					connection_lost = condition.retries >= self.RETRIES_ON_ERROR
 
-			if self._condition_stack['stoponac1']['reached'] and startbycondition not in ['manual', 'testrun']:
+			if inhibit and startbycondition not in ['manual', 'testrun']:
 				start = False
 				if self._dbusservice['/State'] == States.RUNNING and activecondition not in ['manual', 'testrun']:
 					self.log_info('AC input 1 available, stopping')
@@ -385,11 +552,11 @@ class StartStop:
 			# depending on '/OnLossCommunication' setting
 			if not start and connection_lost:
 				# Start always
-				if self._settings['onlosscommunication'] == 1:
+				if self._settings.onlosscommunication == 1:
 					start = True
 					startbycondition = 'lossofcommunication'
 				# Keep running if generator already started
-				if self._dbusservice['/State'] == States.RUNNING and self._settings['onlosscommunication'] == 2:
+				if self._dbusservice['/State'] == States.RUNNING and self._settings.onlosscommunication == 2:
 					start = True
 					startbycondition = 'lossofcommunication'
 
@@ -401,23 +568,23 @@ class StartStop:
 
 		if start:
 			self._start_generator(startbycondition)
-		elif (self._dbusservice['/Runtime'] >= self._settings['minimumruntime'] * 60
+		elif (self._dbusservice['/Runtime'] >= self._settings.minimumruntime * 60
 			  or activecondition == 'manual'):
 			self._stop_generator()
 
-	def _detect_generator_at_acinput(self):
+	def _detect_generator_at_acinput(self, snapshot):
 		state = self._dbusservice['/State']
 
 		if state == States.STOPPED:
 			self._reset_acpower_inverter_input()
 			return
 
-		if self._settings['nogeneratoratacinalarm'] == 0:
+		if self._settings.nogeneratoratacinalarm == 0:
 			self._reset_acpower_inverter_input()
 			return
 
 		vebus_service = self._vebusservice if self._vebusservice else ''
-		activein_state = self._dbusmonitor.get_value(
+		activein_state = snapshot.get_value(
 			vebus_service, '/Ac/ActiveIn/Connected')
 
 		# Path not supported, skip evaluation
@@ -425,7 +592,7 @@ class StartStop:
 			return
 
 		# Sources 0 = Not available, 1 = Grid, 2 = Generator, 3 = Shore
-		generator_acsource = self._dbusmonitor.get_value(
+		generator_acsource = snapshot.get_value(
 			self._system_service, '/Ac/ActiveIn/Source') == 2
 		# Not connected = 0, connected = 1
 		activein_connected = activein_state == 1
@@ -451,68 +618,91 @@ class StartStop:
 		self._dbusservice['/Alarms/NoGeneratorAtAcIn'] = 0
 
 	def _reset_condition(self, condition):
-		condition['reached'] = False
-		if condition['timed']:
-			condition['start_timer'] = 0
-			condition['stop_timer'] = 0
+		condition.reached = False
+		if condition.timed:
+			self._reset_timer(condition, 'start')
+			self._reset_timer(condition, 'stop')
+
+	def _reset_timer(self, condition, timer):
+		self._scheduler.cancel((condition.name, timer))
+		setattr(condition, timer + '_timer', False)
+
+	def _timer_elapsed(self, condition, timer, delay):
+		# The timer starts the first evaluation the start/stop value is reached
+		# and the scheduler marks it as elapsed when it expires.
+		if getattr(condition, timer + '_timer'):
+			return True
+		key = (condition.name, timer)
+		if not self._scheduler.pending(key):
+			if delay <= 0:
+				return True
+			self._scheduler.schedule(key, delay, self._timer_expired, condition, timer)
+		return False
+
+	def _timer_expired(self, condition, timer):
+		setattr(condition, timer + '_timer', True)
+		self._evaluation_needed = True
 
 	def _check_condition(self, condition, value):
-		name = condition['name']
+		name = condition.name
 
-		if self._settings[name + 'enabled'] == 0:
-			if condition['enabled']:
-				condition['enabled'] = False
+		if condition.settings.enabled == 0:
+			if condition.enabled:
+				condition.enabled = False
 				self.log_info('Disabling (%s) condition' % name)
-				condition['retries'] = 0
-				condition['valid'] = True
+				condition.retries = 0
+				condition.valid = True
 				self._reset_condition(condition)
 			return False
 
-		elif not condition['enabled']:
-			condition['enabled'] = True
+		elif not condition.enabled:
+			condition.enabled = True
 			self.log_info('Enabling (%s) condition' % name)
 
-		if (condition['monitoring'] == 'battery') and (self._settings['batterymeasurement'] == 'nobattery'):
+		if (condition.monitoring == 'battery') and (self._settings.batterymeasurement == 'nobattery'):
 			# If no battery monitor is selected reset the condition
 			self._reset_condition(condition)
 			return False
 
-		if value is None and condition['valid']:
-			if condition['retries'] >= self.RETRIES_ON_ERROR:
+		if value is None and condition.valid:
+			if condition.retries >= self.RETRIES_ON_ERROR:
 				logging.info('Error getting (%s) value, skipping evaluation till get a valid value' % name)
 				self._reset_condition(condition)
 				self._comunnication_lost = True
-				condition['valid'] = False
+				condition.valid = False
 			else:
-				condition['retries'] += 1
-				if condition['retries'] == 1 or (condition['retries'] % 10) == 0:
-					self.log_info('Error getting (%s) value, retrying(#%i)' % (name, condition['retries']))
+				condition.retries += 1
+				if condition.retries == 1 or (condition.retries % 10) == 0:
+					self.log_info('Error getting (%s) value, retrying(#%i)' % (name, condition.retries))
 			return False
 
-		elif value is not None and not condition['valid']:
+		elif value is not None and not condition.valid:
 			self.log_info('Success getting (%s) value, resuming evaluation' % name)
-			condition['valid'] = True
-			condition['retries'] = 0
+			condition.valid = True
+			condition.retries = 0
 
 		# Reset retries if value is valid
-		if value is not None and condition['retries'] > 0:
+		if value is not None and condition.retries > 0:
 			self.log_info('Success getting (%s) value, resuming evaluation' % name)
-			condition['retries'] = 0
+			condition.retries = 0
 
-		return condition['valid']
+		return condition.valid
 
 	def _evaluate_condition(self, condition, value):
-		name = condition['name']
-		setting = ('qh_' if self._dbusservice['/QuietHours'] == 1 else '') + name
-		startvalue = self._settings[setting + 'start'] if not condition['boolean'] else 1
-		stopvalue = self._settings[setting + 'stop'] if not condition['boolean'] else 0
+		settings = condition.settings
+		if condition.boolean:
+			startvalue, stopvalue = 1, 0
+		elif self._quiethours:
+			startvalue, stopvalue = settings.qh_start, settings.qh_stop
+		else:
+			startvalue, stopvalue = settings.start, settings.stop
 
 		# Check if the condition has to be evaluated
 		if not self._check_condition(condition, value):
 			# If generator is started by this condition and value is invalid
 			# wait till RETRIES_ON_ERROR to skip the condition
-			if condition['reached'] and condition['retries'] <= self.RETRIES_ON_ERROR:
-				if condition['retries'] > 0:
+			if condition.reached and condition.retries <= self.RETRIES_ON_ERROR:
+				if condition.retries > 0:
 					return True
 
 			return False
@@ -522,70 +712,74 @@ class StartStop:
 		start_is_greater = startvalue > stopvalue
 
 		# When the condition is already reached only the stop value can set it to False
-		start = condition['reached'] or (value >= startvalue if start_is_greater else value <= startvalue)
+		start = condition.reached or (value >= startvalue if start_is_greater else value <= startvalue)
 		stop = value <= stopvalue if start_is_greater else value >= stopvalue
 
 		# Timed conditions must start/stop after the condition has been reached for a minimum
 		# time.
-		if condition['timed']:
-			if not condition['reached'] and start:
-				condition['start_timer'] += time.time() if condition['start_timer'] == 0 else 0
-				start = time.time() - condition['start_timer'] >= self._settings[name + 'starttimer']
-				condition['stop_timer'] *= int(not start)
+		if condition.timed:
+			if not condition.reached and start:
+				start = self._timer_elapsed(condition, 'start', settings.starttimer)
+				if start:
+					self._reset_timer(condition, 'stop')
 				self._timer_runnning = True
 			else:
-				condition['start_timer'] = 0
+				self._reset_timer(condition, 'start')
 
-			if condition['reached'] and stop:
-				condition['stop_timer'] += time.time() if condition['stop_timer'] == 0 else 0
-				stop = time.time() - condition['stop_timer'] >= self._settings[name + 'stoptimer']
-				condition['stop_timer'] *= int(not stop)
+			if condition.reached and stop:
+				stop = self._timer_elapsed(condition, 'stop', settings.stoptimer)
+				if stop:
+					self._reset_timer(condition, 'stop')
 				self._timer_runnning = True
 			else:
-				condition['stop_timer'] = 0
+				self._reset_timer(condition, 'stop')
 
-		condition['reached'] = start and not stop
-		return condition['reached']
+		condition.reached = start and not stop
+		return condition.reached
 
 	def _evaluate_manual_start(self):
 		if self._dbusservice['/ManualStart'] == 0:
+			self._scheduler.cancel('manualstart')
 			if self._dbusservice['/RunningByCondition'] == 'manual':
 				self._dbusservice['/ManualStartTimer'] = 0
 			return False
 
-		start = True
 		# If /ManualStartTimer has a value greater than zero will use it to set a stop timer.
 		# If no timer is set, the generator will not stop until the user stops it manually.
-		# Once started by manual start, each evaluation the timer is decreased
-		if self._dbusservice['/ManualStartTimer'] != 0:
-			self._manualstarttimer += time.time() if self._manualstarttimer == 0 else 0
-			self._dbusservice['/ManualStartTimer'] -= int(time.time()) - int(self._manualstarttimer)
-			self._manualstarttimer = time.time()
-			start = self._dbusservice['/ManualStartTimer'] > 0
-			self._dbusservice['/ManualStart'] = int(start)
-			# Reset if timer is finished
-			self._manualstarttimer *= int(start)
-			self._dbusservice['/ManualStartTimer'] *= int(start)
-
-		return start
-
-	def _evaluate_testrun_condition(self):
-		if self._settings['testrunenabled'] == 0:
-			self._dbusservice['/SkipTestRun'] = None
-			self._dbusservice['/NextTestRun'] = None
-			return False
+		# Once started by manual start, each evaluation the remaining time is published.
+		timer = self._dbusservice['/ManualStartTimer']
+		if timer != 0:
+			# A value different from the last one published is a new timer set by the user
+			if timer != self._manualstarttimer or not self._scheduler.pending('manualstart'):
+				self._scheduler.schedule('manualstart', timer, self._manual_start_expired)
+			self._manualstarttimer = int(math.ceil(self._scheduler.remaining('manualstart')))
+			self._dbusservice['/ManualStartTimer'] = self._manualstarttimer
+
+		return True
+
+	def _manual_start_changed(self, path, value):
+		# Written by the user, evaluated on the next tick
+		self._evaluation_needed = True
+		self._wakeup()
+		return True
+
+	def _manual_start_expired(self):
+		self._dbusservice['/ManualStart'] = 0
+		self._dbusservice['/ManualStartTimer'] = 0
+		self._manualstarttimer = 0
+		self._evaluation_needed = True
 
-		today = datetime.date.today()
+	def _plan_testrun(self):
+		now = self._now.time
+		plan = TestRunPlan(now)
+		today = self._now.today
 		yesterday = today - datetime.timedelta(days=1) # Should deal well with DST
-		now = time.time()
-		runtillbatteryfull = self._settings['testruntillbatteryfull'] == 1
-		soc = self._get_updated_values()['soc']
-		batteryisfull = runtillbatteryfull and soc == 100
-		duration = 60 if runtillbatteryfull else self._settings['testrunruntime']
+		duration = 60 if self._settings.testruntillbatteryfull == 1 else self._settings.testrunruntime
+		tomorrow = self._now.nextmidnight
 
 		try:
-			startdate = datetime.date.fromtimestamp(self._settings['testrunstartdate'])
-			_starttime = time.mktime(yesterday.timetuple()) + self._settings['testrunstarttimer']
+			startdate = datetime.date.fromtimestamp(self._settings.testrunstartdate)
+			_starttime = self._now.local_midnight(yesterday) + self._settings.testrunstarttimer
 
 			# today might in fact still be yesterday, if this test run started
 			# before midnight and finishes after. If `now` still falls in
@@ -597,29 +791,71 @@ class StartStop:
 				today = yesterday
 				starttime = _starttime
 			else:
-				starttime = time.mktime(today.timetuple()) + self._settings['testrunstarttimer']
+				starttime = self._now.midnight + self._settings.testrunstarttimer
 		except ValueError:
 			logging.debug('Invalid dates, skipping testrun')
-			return False
+			plan.valid = False
+			return plan
+
+		# Windows end right after their stop time, the plan is made again a
+		# second later. A window starting or ending changes the plan, also
+		# before the start date: yesterday's window might still be running.
+		todaystart = self._now.midnight + self._settings.testrunstarttimer
+		if now in (_starttime + duration, todaystart + duration):
+			plan.validuntil = now + 1
+		else:
+			plan.validuntil = min([tomorrow] + [t for t in (_starttime + duration, todaystart,
+								todaystart + duration) if t > now])
 
 		# If start date is in the future set as NextTestRun and stop evaluating
 		if startdate > today:
-			self._dbusservice['/NextTestRun'] = time.mktime(startdate.timetuple())
+			plan.future = True
+			plan.nextrun = self._now.local_midnight(startdate)
+			return plan
+
+		interval = self._settings.testruninterval
+		stoptime = starttime + duration
+		elapseddays = (today - startdate).days
+		mod = elapseddays % interval
+
+		plan.due = not bool(mod)
+		plan.start = starttime
+		plan.stop = stoptime
+		if plan.due and (now <= stoptime):
+			plan.nextrun = starttime
+		else:
+			plan.nextrun = (self._now.local_midnight(today + datetime.timedelta(days=interval - mod)) +
+							self._settings.testrunstarttimer)
+		return plan
+
+	def _evaluate_testrun_condition(self, soc):
+		if self._settings.testrunenabled == 0:
+			self._dbusservice['/SkipTestRun'] = None
+			self._dbusservice['/NextTestRun'] = None
 			return False
 
+		# The window is only planned again when it can have changed
+		now = self._now.time
+		plan = self._testrunplan
+		if plan is None or not plan.validfrom <= now < plan.validuntil:
+			plan = self._testrunplan = self._plan_testrun()
+		if not plan.valid:
+			return False
+		if plan.future:
+			self._dbusservice['/NextTestRun'] = plan.nextrun
+			return False
+
+		runtillbatteryfull = self._settings.testruntillbatteryfull == 1
+		batteryisfull = runtillbatteryfull and soc == 100
+
 		start = False
 		# If the accumulated runtime during the tes trun interval is greater than '/TestRunIntervalRuntime'
 		# the tes trun must be skipped
-		needed = (self._settings['testrunskipruntime'] > self._dbusservice['/TestRunIntervalRuntime']
-					  or self._settings['testrunskipruntime'] == 0)
+		needed = (self._settings.testrunskipruntime > self._dbusservice['/TestRunIntervalRuntime']
+					  or self._settings.testrunskipruntime == 0)
 		self._dbusservice['/SkipTestRun'] = int(not needed)
 
-		interval = self._settings['testruninterval']
-		stoptime = starttime + duration
-		elapseddays = (today - startdate).days
-		mod = elapseddays % interval
-
-		start = not bool(mod) and starttime <= now <= stoptime
+		start = plan.due and plan.start <= now <= plan.stop
 
 		if runtillbatteryfull:
 			if soc is not None:
@@ -637,34 +873,49 @@ class StartStop:
 			else:
 				start = False
 
-		if not bool(mod) and (now <= stoptime):
-			self._dbusservice['/NextTestRun'] = starttime
-		else:
-			self._dbusservice['/NextTestRun'] = (time.mktime((today + datetime.timedelta(days=interval - mod)).timetuple()) +
-												 self._settings['testrunstarttimer'])
+		self._dbusservice['/NextTestRun'] = plan.nextrun
 		return start and needed
 
+	def _schedule_quiet_hours(self):
+		# Quiet hours state now and the next time it can change: start, end
+		# or midnight, the times being seconds after the local midnight.
+		now = self._now
+		self._quiethoursfrom = now.time
+		if self._settings.quiethoursenabled != 1:
+			self._quiethoursactive = False
+			self._quiethoursuntil = float('inf')
+			return
+
+		timeinseconds = now.seconds_since_midnight
+		quiethoursstart = self._settings.quiethoursstarttime
+		quiethoursend = self._settings.quiethoursendtime
+
+		# Check if the current time is between the start time and end time
+		if quiethoursstart < quiethoursend:
+			active = quiethoursstart <= timeinseconds and timeinseconds < quiethoursend
+		else:  # End time is lower than start time, example Start: 21:00, end: 08:00
+			# The end time is not included, like for the quiet hours within a
+			# day, so the state holds till the next boundary after now
+			active = not (quiethoursend <= timeinseconds and timeinseconds < quiethoursstart)
+		self._quiethoursactive = active
+
+		self._quiethoursuntil = min([now.nextmidnight] + [now.midnight + t for t in
+			(quiethoursstart, quiethoursend) if now.midnight + t > now.time])
+
 	def _check_quiet_hours(self):
-		active = False
-		if self._settings['quiethoursenabled'] == 1:
-			# Seconds after today 00:00
-			timeinseconds = time.time() - time.mktime(datetime.date.today().timetuple())
-			quiethoursstart = self._settings['quiethoursstarttime']
-			quiethoursend = self._settings['quiethoursendtime']
-
-			# Check if the current time is between the start time and end time
-			if quiethoursstart < quiethoursend:
-				active = quiethoursstart <= timeinseconds and timeinseconds < quiethoursend
-			else:  # End time is lower than start time, example Start: 21:00, end: 08:00
-				active = not (quiethoursend < timeinseconds and timeinseconds < quiethoursstart)
-
-		if self._dbusservice['/QuietHours'] == 0 and active:
-			self.log_info('Entering to quiet mode')
+		if not self._quiethoursfrom <= self._now.time < self._quiethoursuntil:
+			self._schedule_quiet_hours()
+		active = self._quiethoursactive
+		if active == self._quiethours:
+			return active
 
-		elif self._dbusservice['/QuietHours'] == 1 and not active:
+		if active:
+			self.log_info('Entering to quiet mode')
+		else:
 			self.log_info('Leaving quiet mode')
 
 		self._dbusservice['/QuietHours'] = int(active)
+		self._quiethours = active
 
 		return active
 
@@ -672,107 +923,29 @@ class StartStop:
 		seconds = self._dbusservice['/Runtime']
 		accumulated = seconds - self._last_runtime_update
 
-		self._settings['accumulatedtotal'] = int(self._settings['accumulatedtotal']) + accumulated
-		# Using calendar to get timestamp in UTC, not local time
-		today_date = str(calendar.timegm(datetime.date.today().timetuple()))
-
-		# If something goes wrong getting the json string create a new one
-		try:
-			accumulated_days = json.loads(self._settings['accumulateddaily'])
-		except ValueError:
-			accumulated_days = {today_date: 0}
-
-		if (today_date in accumulated_days):
-			accumulated_days[today_date] += accumulated
-		else:
-			accumulated_days[today_date] = accumulated
-
+		self._counters.add(self._day, accumulated)
 		self._last_runtime_update = seconds
 
-		# Keep the historical with a maximum of HISTORY_DAYS
-		while len(accumulated_days) > self.HISTORY_DAYS:
-			accumulated_days.pop(min(accumulated_days.keys()), None)
+		# Settings are written in batches
+		interval = self._settings.accumulatedsaveinterval
+		if interval == 0:
+			self._flush_counters()
+		elif not self._scheduler.pending('savecounters'):
+			self._scheduler.schedule('savecounters', interval, self._flush_counters)
 
-		# Upadate settings
-		self._settings['accumulateddaily'] = json.dumps(accumulated_days, sort_keys=True)
 		self._dbusservice['/TodayRuntime'] = self._interval_runtime(0)
-		self._dbusservice['/TestRunIntervalRuntime'] = self._interval_runtime(self._settings['testruninterval'])
-
-	def _interval_runtime(self, days):
-		summ = 0
-		try:
-			daily_record = json.loads(self._settings['accumulateddaily'])
-		except ValueError:
-			return 0
-
-		for i in range(days + 1):
-			previous_day = calendar.timegm((datetime.date.today() - datetime.timedelta(days=i)).timetuple())
-			if str(previous_day) in daily_record.keys():
-				summ += daily_record[str(previous_day)] if str(previous_day) in daily_record.keys() else 0
-
-		return summ
-
-	def _get_updated_values(self):
-		battery_service = self._battery_service if self._battery_service else ''
-		battery_prefix = self._battery_prefix if self._battery_prefix else ''
-		vebus_service = self._vebusservice if self._vebusservice else ''
-		loadOnAcOut = []
-		totalConsumption = []
-		inverterHighTemp = []
-		inverterOverload = []
-
-		values = {
-			'batteryvoltage': self._dbusmonitor.get_value(battery_service, battery_prefix + '/Voltage'),
-			'batterycurrent': self._dbusmonitor.get_value(battery_service, battery_prefix + '/Current'),
-			'soc': self._dbusmonitor.get_value(battery_service, '/Soc'),
-			'inverterhightemp': self._dbusmonitor.get_value(vebus_service, '/Alarms/HighTemperature'),
-			'inverteroverload': self._dbusmonitor.get_value(vebus_service, '/Alarms/Overload')
-		}
-
-		for phase in ['L1', 'L2', 'L3']:
-			loadOnAcOut.append(self._dbusmonitor.get_value(vebus_service, ('/Ac/Out/%s/P' % phase)))
-			totalConsumption.append(self._dbusmonitor.get_value(self._system_service, ('/Ac/Consumption/%s/Power' % phase)))
-			inverterHighTemp.append(self._dbusmonitor.get_value(vebus_service, ('/Alarms/%s/HighTemperature' % phase)))
-			inverterOverload.append(self._dbusmonitor.get_value(vebus_service, ('/Alarms/%s/Overload' % phase)))
-
-		# Toltal consumption
-		if self._settings['acloadmeasuerment'] == 0:
-			values['acload'] = sum(filter(None, totalConsumption))
-
-		# Load on inverter AC out
-		if self._settings['acloadmeasuerment'] == 1:
-			values['acload'] = sum(filter(None, loadOnAcOut))
-
-		# Highest phase load
-		if self._settings['acloadmeasuerment'] == 2:
-			values['acload'] = max(loadOnAcOut)
-
-		# AC input 1
-		activein = self._dbusmonitor.get_value(vebus_service, '/Ac/ActiveIn/ActiveInput')
-		# Active input is connected
-		connected = self._dbusmonitor.get_value(vebus_service, '/Ac/ActiveIn/Connected')
-		if None not in (activein, connected):
-			values['stoponac1'] = activein == 0 and connected == 1
-		else:
-			values['stoponac1'] = None
+		self._dbusservice['/TestRunIntervalRuntime'] = self._interval_runtime(self._settings.testruninterval)
 
-		# Invalidate if vebus is not available
-		if loadOnAcOut[0] == None:
-			values['acload'] = None
+	def _flush_counters(self):
+		self._scheduler.cancel('savecounters')
+		self._counters.flush()
 
-		if values['batterycurrent']:
-			values['batterycurrent'] *= -1
-
-		# When multi is connected to CAN-bus, alarms are published to
-		# /Alarms/Overload... but when connected to vebus alarms are
-		# splitted in three phases and published to /Alarms/LX/Overload...
-		if values['inverteroverload'] == None:
-			values['inverteroverload'] = max(inverterOverload)
-
-		if values['inverterhightemp'] == None:
-			values['inverterhightemp'] = max(inverterHighTemp)
+	def _interval_runtime(self, days):
+		return self._history.runtime(self._day, days)
 
-		return values
+	def _read_clock(self):
+		# Entry points outside the tick take their own reading
+		self._now = self._clock.read()
 
 	def _determineservices(self):
 		# batterymeasurement is either 'default' or 'com_victronenergy_battery_288/Dc/0'.
@@ -781,14 +954,14 @@ class StartStop:
 		batterymeasurement = None
 		newbatteryservice = None
 		batteryprefix = ''
-		selectedbattery = self._settings['batterymeasurement']
+		selectedbattery = self._settings.batterymeasurement
 		vebusservice = None
 
 		if selectedbattery == 'default':
 			batterymeasurement = self._dbusmonitor.get_value('com.victronenergy.system',
 			'/AutoSelectedBatteryMeasurement')
 		elif len(selectedbattery.split('/', 1)) == 2:  # Only very basic sanity checking..
-			batterymeasurement = self._settings['batterymeasurement']
+			batterymeasurement = self._settings.batterymeasurement
 		elif selectedbattery == 'nobattery':
 			batterymeasurement = None
 		else:
@@ -805,15 +978,10 @@ class StartStop:
 			oldservice = None
 
 		if batterymeasurement:
-			battery_instance = int(batterymeasurement.split('_', 3)[3].split('/')[0])
-			service_type = None
-
-			if 'vebus' in batterymeasurement:
-				service_type = 'vebus'
-			elif 'battery' in batterymeasurement:
-				service_type = 'battery'
-
-			newbatteryservice = self._get_servicename_by_instance(battery_instance, service_type)
+			# com_victronenergy_battery_258/Dc/0
+			parts = batterymeasurement.split('_', 3)
+			battery_instance = int(parts[3].split('/')[0])
+			newbatteryservice = self._serviceindex.get(parts[2], battery_instance)
 
 
 		if newbatteryservice and newbatteryservice != oldservice:
@@ -829,6 +997,11 @@ class StartStop:
 			self._battery_service = newbatteryservice
 			self._battery_prefix = batteryprefix
 
+		# Paths are built here instead of on every evaluation
+		batteryprefix = self._battery_prefix if self._battery_prefix else ''
+		self._battery_voltage_path = batteryprefix + '/Voltage'
+		self._battery_current_path = batteryprefix + '/Current'
+
 		# Get the default VE.Bus service
 		vebusservice = self._dbusmonitor.get_value('com.victronenergy.system', '/VebusService')
 		if vebusservice:
@@ -842,22 +1015,8 @@ class StartStop:
 				self.log_info('Error getting Vebus service!')
 			self._vebusservice = None
 
-	def _get_servicename_by_instance(self, instance, service_type=None):
-		sv = None
-		services = self._dbusmonitor.get_service_list()
-
-		for service in services:
-			if service_type and service_type not in service:
-				continue
-
-			if services[service] == instance:
-				sv = service
-				break
-
-		return sv
-
 	def _get_monotonic_seconds(self):
-		return monotonic_time.monotonic_time().to_seconds_double()
+		return self._now.monotonic
 
 	def _start_generator(self, condition):
 		state = self._dbusservice['/State']
@@ -868,7 +1027,7 @@ class StartStop:
 		if state == States.STOPPED or remote_state != state:
 			self._dbusservice['/State'] = States.RUNNING
 			self._update_remote_switch()
-			self._starttime = monotonic_time.monotonic_time().to_seconds_double()
+			self._starttime = self._now.monotonic
 			self.log_info('Starting generator by %s condition' % condition)
 		elif self._dbusservice['/RunningByCondition'] != condition:
 			self.log_info('Generator previously running by %s condition is now running by %s condition'
@@ -887,9 +1046,11 @@ class StartStop:
 						str(self._dbusservice['/RunningByCondition']))
 			self._dbusservice['/RunningByCondition'] = ''
 			self._update_accumulated_time()
+			self._flush_counters()
 			self._starttime = 0
 			self._dbusservice['/Runtime'] = 0
 			self._dbusservice['/ManualStartTimer'] = 0
+			self._scheduler.cancel('manualstart')
 			self._manualstarttimer = 0
 			self._last_runtime_update = 0
 
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+
+# Benchmarks of the hot paths, using the same mocks as generator_test.py
+# Every combination of the number of start/stop instances, extra services
+# on the bus and enabled conditions is measured for:
+# - tick: cost of Generator._handletimertick, an input of the enabled
+#   conditions changes before every tick so all the instances evaluate them
+# - dispatch: cost of Generator._dbus_value_changed for the inputs
+# - startup: cost of Generator.__init__ with all the services on the bus
+# - memory: size of the python objects created by the Generator
+# The results are written as json, and compared with a previous run with
+# --compare.
+
+import argparse
+import gc
+import itertools
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+# our own packages
+test_dir = os.path.dirname(__file__)
+sys.path.insert(0, test_dir)
+sys.path.insert(1, os.path.join(test_dir, '..', 'ext', 'velib_python', 'test'))
+sys.path.insert(1, os.path.join(test_dir, '..'))
+import gobject
+from generator_test import MockGenerator
+from mock_dbus_monitor import MockDbusMonitor
+import conditions
+import dbus_generator
+
+def service_values(values, instance=0):
+	values['/Connected'] = 1
+	values['/ProductName'] = 'dummy'
+	values['/Mgmt/Connection'] = 'dummy'
+	values.setdefault('/DeviceInstance', instance)
+	return values
+
+def get_services(gensets, extra):
+	# Services on the bus, the extra ones are battery monitors not in use
+	services = {
+		'com.victronenergy.system': service_values({
+			'/Ac/Consumption/L1/Power': 650,
+			'/Ac/Consumption/L2/Power': 650,
+			'/Ac/Consumption/L3/Power': 650,
+			'/Ac/ActiveIn/Source': 2,
+			'/AutoSelectedBatteryMeasurement': 'com_victronenergy_battery_258/Dc/0',
+			'/VebusService': 'com.victronenergy.vebus.ttyO1',
+			'/Relay/0/State': 0
+			}),
+		'com.victronenergy.settings': service_values({
+			'/Settings/Relay/Function': 1,
+			'/Settings/System/TimeZone': 'Europe/Berlin',
+			'/Settings/Services/FischerPandaAutoStartStop': 1
+			}),
+		'com.victronenergy.vebus.ttyO1': service_values({
+			'/Alarms/Overload': 0,
+			'/Alarms/HighTemperature': 0,
+			'/Ac/Out/L1/P': 500,
+			'/Ac/Out/L2/P': 500,
+			'/Ac/Out/L3/P': 500,
+			'/Ac/ActiveIn/ActiveInput': 1,
+			'/Ac/ActiveIn/Connected': 0,
+			'/Dc/0/Voltage': 14.4,
+			'/Dc/0/Current': 10,
+			'/Soc': 87
+			}, instance=251),
+		'com.victronenergy.battery.ttyO5': service_values({
+			'/Dc/0/Voltage': 14.4,
+			'/Dc/0/Current': 10,
+			'/Soc': 87
+			}, instance=258)
+		}
+	for n in range(gensets):
+		services['com.victronenergy.genset.socketcan_can1_di%d_uc0' % n] = service_values({
+			'/Start': 0,
+			'/AutoStart': 1,
+			'/ProductId': 0xB040,
+			'/ErrorCode': 0
+			})
+	for n in range(extra):
+		services['com.victronenergy.battery.ttyUSB%d' % n] = service_values({
+			'/Dc/0/Voltage': 12.8,
+			'/Dc/0/Current': 1,
+			'/Soc': 50
+			}, instance=300 + n)
+	return services
+
+class BenchGenerator(MockGenerator):
+	# Services already on the bus when the Generator starts
+	services = {}
+
+	def _create_dbus_monitor(self, *args, **kwargs):
+		monitor = MockDbusMonitor(*args, **kwargs)
+		callback, monitor._device_added_callback = monitor._device_added_callback, None
+		for service, values in self.services.items():
+			monitor.add_service(service, dict(values))
+		monitor._device_added_callback = callback
+		return monitor
+
+# Inputs changed before every tick and dispatched, one per enabled condition
+inputs = {
+	'soc': ('com.victronenergy.battery.ttyO5', '/Soc', 60, 61),
+	'acload': ('com.victronenergy.vebus.ttyO1', '/Ac/Out/L1/P', 500, 501),
+	'batterycurrent': ('com.victronenergy.battery.ttyO5', '/Dc/0/Current', 10, 11),
+	'batteryvoltage': ('com.victronenergy.battery.ttyO5', '/Dc/0/Voltage', 14.4, 14.5),
+	'inverterhightemp': ('com.victronenergy.vebus.ttyO1', '/Alarms/HighTemperature', 0, 0),
+	'inverteroverload': ('com.victronenergy.vebus.ttyO1', '/Alarms/Overload', 0, 0),
+	'stoponac1': ('com.victronenergy.vebus.ttyO1', '/Ac/ActiveIn/Connected', 0, 0)
+	}
+
+def create_generator(instances, services, enabled):
+	# instances includes the built-in relay, the others are gensets
+	gobject.timer_manager.reset()
+	BenchGenerator.services = get_services(instances - 1, services)
+	generator = BenchGenerator()
+	for name in generator._names.values():
+		settings = generator._get_settings(name)
+		for cls in conditions.registry[:enabled]:
+			settings[cls.name + 'enabled' + name] = 1
+		settings['acloadmeasuerment' + name] = 1
+	return generator
+
+def get_changes(enabled):
+	changes = [inputs[cls.name] for cls in conditions.registry[:enabled]]
+	return changes or [inputs['soc']]
+
+def bench_tick(generator, enabled, ticks):
+	# Seconds per tick
+	monitor = generator._dbusmonitor
+	changes = get_changes(enabled)
+	start = time.time()
+	for i in range(ticks):
+		for service, path, a, b in changes:
+			monitor.set_value(service, path, b if i % 2 else a)
+		generator._handletimertick()
+	return (time.time() - start) / ticks
+
+def bench_dispatch(generator, enabled, events):
+	# Seconds per value change
+	changes = get_changes(enabled)
+	start = time.time()
+	for i in range(events):
+		service, path, a, b = changes[i % len(changes)]
+		generator._dbus_value_changed(service, path, None, None, None)
+	return (time.time() - start) / events
+
+def bench_startup(instances, services, enabled, repeat):
+	# Seconds per Generator.__init__, best of repeat
+	BenchGenerator.services = get_services(instances - 1, services)
+	best = None
+	for i in range(repeat):
+		gobject.timer_manager.reset()
+		start = time.time()
+		BenchGenerator()
+		elapsed = time.time() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+
+def object_size(o, seen):
+	# Size of an object and of the ones it refers to, the shared ones
+	# (classes, modules, functions) are left out
+	if id(o) in seen or isinstance(o, (type, type(sys), type(object_size))):
+		return 0
+	seen.add(id(o))
+	size = sys.getsizeof(o)
+	for r in gc.get_referents(o):
+		size += object_size(r, seen)
+	return size
+
+def bench_memory(generator):
+	# Bytes
+	return object_size(generator, set([id(conditions.registry)]))
+
+def run(instances, services, enabled, args):
+	generator = create_generator(instances, services, enabled)
+	return {
+		'instances': instances,
+		'services': services,
+		'conditions': enabled,
+		'tick_us': bench_tick(generator, enabled, args.ticks) * 1e6,
+		'dispatch_us': bench_dispatch(generator, enabled, args.events) * 1e6,
+		'startup_ms': bench_startup(instances, services, enabled, args.repeat) * 1e3,
+		'memory_kb': bench_memory(generator) / 1024.0
+		}
+
+metrics = ('tick_us', 'dispatch_us', 'startup_ms', 'memory_kb')
+
+def key(result):
+	return (result['instances'], result['services'], result['conditions'])
+
+def compare(results, baseline):
+	# Ratio of each metric to the baseline of the same case
+	base = dict((key(r), r) for r in baseline['results'])
+	print '\n%10s %10s %10s' % ('instances', 'services', 'conditions') + \
+		''.join('%14s' % m for m in metrics)
+	for r in results:
+		b = base.get(key(r))
+		if b is None:
+			continue
+		print '%10d %10d %10d' % key(r) + \
+			''.join('%13.2fx' % (r[m] / b[m] if b[m] else 0) for m in metrics)
+
+def int_list(s):
+	return [int(v) for v in s.split(',')]
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmarks of the tick and dispatch hot paths')
+	parser.add_argument('-i', '--instances', type=int_list, default=[1, 4, 16],
+						help='numbers of start/stop instances, comma separated, the built-in relay included')
+	parser.add_argument('-s', '--services', type=int_list, default=[0, 32],
+						help='numbers of extra services on the bus, comma separated')
+	parser.add_argument('-c', '--conditions', type=int_list, default=[1, len(conditions.registry)],
+						help='numbers of enabled conditions, comma separated, in registry order')
+	parser.add_argument('-t', '--ticks', type=int, default=1000, help='ticks per measurement')
+	parser.add_argument('-e', '--events', type=int, default=10000, help='value changes per measurement')
+	parser.add_argument('-r', '--repeat', type=int, default=5, help='startups per measurement')
+	parser.add_argument('-o', '--output', help='write the results to this json file')
+	parser.add_argument('--compare', help='json file of a previous run to compare with')
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.WARNING)
+
+	results = []
+	print '%10s %10s %10s' % ('instances', 'services', 'conditions') + \
+		''.join('%14s' % m for m in metrics)
+	for case in itertools.product(args.instances, args.services, args.conditions):
+		result = run(case[0], case[1], case[2], args)
+		results.append(result)
+		print '%10d %10d %10d' % case + ''.join('%14.1f' % result[m] for m in metrics)
+
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump({
+				'version': dbus_generator.softwareversion,
+				'python': platform.python_version(),
+				'machine': platform.machine(),
+				'time': int(time.time()),
+				'ticks': args.ticks,
+				'events': args.events,
+				'results': results
+				}, f, indent=1, sort_keys=True)
+
+	if args.compare:
+		with open(args.compare) as f:
+			compare(results, json.load(f))
+
+if __name__ == '__main__':
+	main()
@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 import json
+import time
+import StringIO
+import shutil
+import tempfile
 import os
 import sys
 import unittest
-from time import sleep
 import datetime
 import calendar
 
@@ -18,7 +21,14 @@ from logger import setup_logging
 from mock_dbus_monitor import MockDbusMonitor
 from mock_dbus_service import MockDbusService
 from mock_settings_device import MockSettingsDevice
-from gen_utils import Errors, States
+from gen_utils import Errors, States, DBusServicePrefix, PhaseValues
+from scheduler import DeadlineScheduler
+from history import RuntimeHistory
+import conditions
+import replay
+import recorder
+from instrumentation import TimingStats
+from clock import VirtualClock, LocalZone
 
 
 class MockGenerator(dbus_generator.Generator):
@@ -27,12 +37,15 @@ class MockGenerator(dbus_generator.Generator):
 		return MockDbusMonitor(*args, **kwargs)
 
 	def _create_settings(self, *args, **kwargs):
-		self._settings = MockSettingsDevice(*args, **kwargs)
-		return self._settings
+		return MockSettingsDevice(*args, **kwargs)
 
 	def _create_dbus_service(self):
 		return MockDbusService('com.victronenergy.generator.startstop0')
 
+	def _create_clock(self):
+		# Moves with the mock timers
+		return gobject.timer_manager.clock
+
 
 class TestGeneratorBase(unittest.TestCase):
 	def __init__(self, methodName='runTest'):
@@ -59,22 +72,31 @@ class TestGeneratorBase(unittest.TestCase):
 	def _remove_device(self, service):
 		self._monitor.remove_service(service)
 
+	def _write(self, path, value):
+		# A write over dbus, the change callback is called first
+		callback = self._service._callbacks.get(path)
+		if callback is None or callback(path, value):
+			self._service[path] = value
+
 	def _set_setting(self, path, value):
 		self._generator_._settings[self._generator_._settings.get_short_name(path)] = value
 
+	def _now(self):
+		return datetime.datetime.fromtimestamp(gobject.timer_manager.clock.time())
+
 	def _today(self):
-		now = datetime.datetime.now()
+		now = self._now()
 		midnight = datetime.datetime.combine(now.date(), datetime.time(0))
 		return calendar.timegm(midnight.timetuple())
 
 	def _seconds_since_midnight(self):
-		now = datetime.datetime.now()
+		now = self._now()
 		midnight = datetime.datetime.combine(now.date(), datetime.time(0))
 		delta = now - midnight
 		return delta.total_seconds()
 
 	def _yesterday(self):
-		now = datetime.datetime.now()
+		now = self._now()
 		midnight = datetime.datetime.combine(now.date(), datetime.time(0))
 		yesterday = midnight - datetime.timedelta(days=1)
 		return calendar.timegm(yesterday.timetuple())
@@ -446,6 +468,22 @@ class TestGenerator(TestGeneratorBase):
 			'/FischerPanda0/Error': Errors.NONE
 		})
 
+	def test_fischerpanda_autostartstop_setting(self):
+		self._update_values()
+		self._check_values({
+			'/FischerPanda0/State': States.STOPPED
+		})
+
+		self._monitor.set_value('com.victronenergy.settings', '/Settings/Services/FischerPandaAutoStartStop', 0)
+		self._update_values()
+		self.assertFalse('/FischerPanda0/State' in self._service)
+
+		self._monitor.set_value('com.victronenergy.settings', '/Settings/Services/FischerPandaAutoStartStop', 1)
+		self._update_values()
+		self._check_values({
+			'/FischerPanda0/State': States.STOPPED
+		})
+
 	def test_overload_alarm_vebus(self):
 		self._set_setting('/Settings/Generator0/InverterOverload/Enabled', 1)
 		self._set_setting('/Settings/Generator0/InverterOverload/StartTimer', 0)
@@ -539,7 +577,8 @@ class TestGenerator(TestGeneratorBase):
 	def test_testrun(self):
 		self._set_setting('/Settings/Generator0/TestRun/Enabled', 1)
 		self._set_setting('/Settings/Generator0/TestRun/StartDate', self._yesterday())
-		self._set_setting('/Settings/Generator0/TestRun/StartTime', self._seconds_since_midnight())
+		# Due at the second update, one second later
+		self._set_setting('/Settings/Generator0/TestRun/StartTime', self._seconds_since_midnight() + 1)
 		self._set_setting('/Settings/Generator0/TestRun/Interval', 2)
 		self._set_setting('/Settings/Generator0/TestRun/Duration', 2)
 		self._set_setting('/Settings/Generator0/TestRun/SkipRuntime', 0)
@@ -560,23 +599,217 @@ class TestGenerator(TestGeneratorBase):
 			'/Generator0/State': States.RUNNING,
 		})
 
-		sleep(1)
 		self._monitor.set_value('com.victronenergy.vebus.ttyO1', '/Ac/ActiveIn/ActiveInput', 0)
 		self._update_values()
 		self._check_values({
 			'/Generator0/State': States.RUNNING
 		})
 
-		sleep(1)
 		self._update_values()
 		self._check_values({
 			'/Generator0/State': States.STOPPED,
 		})
 
+	def test_testrun_days(self):
+		# A daily test run of a minute, a day and two hours of virtual time
+		self._set_setting('/Settings/Generator0/TestRun/Enabled', 1)
+		self._set_setting('/Settings/Generator0/TestRun/StartDate', self._yesterday())
+		self._set_setting('/Settings/Generator0/TestRun/StartTime', self._seconds_since_midnight() + 3600)
+		self._set_setting('/Settings/Generator0/TestRun/Interval', 1)
+		self._set_setting('/Settings/Generator0/TestRun/Duration', 60)
+
+		self._update_values(26 * 3600 * 1000)
+		self._check_values({
+			'/Generator0/State': States.STOPPED,
+			'/Generator0/TodayRuntime': 60
+		})
+		self.assertEqual(self._generator_._settings['accumulatedtotalGenerator0'], 120)
+
+	def test_timezone_settings_added(self):
+		# The settings service appeared after the generator was created
+		self.assertEqual(self._generator_._clock.zone.name, 'Europe/Berlin')
+		self.assertEqual(self._now().time(), datetime.time(14, 0))
+		self._monitor.set_value('com.victronenergy.settings', '/Settings/System/TimeZone', 'UTC')
+		self.assertEqual(self._now().time(), datetime.time(12, 0))
+
+	def test_testrun_start_after_overnight_window(self):
+		# 00:30, in yesterday's 23:00 - 01:00 window
+		self._update_values(int((86400 + 1800 - self._seconds_since_midnight()) * 1000))
+		midnight = time.mktime(self._now().date().timetuple())
+		self._set_setting('/Settings/Generator0/TestRun/StartDate', self._today())
+		self._set_setting('/Settings/Generator0/TestRun/StartTime', 23 * 3600)
+		self._set_setting('/Settings/Generator0/TestRun/Interval', 1)
+		self._set_setting('/Settings/Generator0/TestRun/Duration', 7200)
+		self._set_setting('/Settings/Generator0/TestRun/Enabled', 1)
+		self._update_values()
+		# Nothing before the start date
+		self._check_values({
+			'/Generator0/State': States.STOPPED,
+			'/Generator0/NextTestRun': midnight
+		})
+
+		# Planned again once yesterday's window is over
+		self._update_values(5400000)
+		self._monitor.set_value('com.victronenergy.battery.ttyO5', '/Soc', 86)
+		self._update_values()
+		self._check_values({
+			'/Generator0/NextTestRun': midnight + 23 * 3600
+		})
+		self._update_values(int((midnight + 23 * 3600 - gobject.timer_manager.clock.time()) * 1000) + 1000)
+		self._check_values({
+			'/Generator0/State': States.RUNNING,
+			'/Generator0/RunningByCondition': 'testrun'
+		})
+
+	def test_testrun_plan(self):
+		instance = self._generator_._instances['generator0']
+		self._set_setting('/Settings/Generator0/TestRun/Enabled', 1)
+		self._set_setting('/Settings/Generator0/TestRun/StartDate', self._yesterday())
+		self._set_setting('/Settings/Generator0/TestRun/StartTime', self._seconds_since_midnight() + 2)
+		self._set_setting('/Settings/Generator0/TestRun/Interval', 1)
+		self._set_setting('/Settings/Generator0/TestRun/Duration', 2)
+		start = gobject.timer_manager.clock.time() + 2
+
+		self._update_values()
+		plan = instance._testrunplan
+		self.assertEqual(plan.validuntil, start)
+		self._check_values({
+			'/Generator0/State': States.STOPPED,
+			'/Generator0/NextTestRun': start
+		})
+
+		# Planned again at the start and after the stop
+		self._update_values()
+		self.assertFalse(instance._testrunplan is plan)
+		plan = instance._testrunplan
+		self.assertEqual(plan.validuntil, start + 2)
+		self._check_values({
+			'/Generator0/State': States.RUNNING
+		})
+		self._update_values()
+		self.assertTrue(instance._testrunplan is plan)
+		self._update_values()
+		self._update_values()
+		self._check_values({
+			'/Generator0/State': States.STOPPED,
+			'/Generator0/NextTestRun': start + 86400
+		})
+
+		# A setting change plans it again
+		self._set_setting('/Settings/Generator0/TestRun/Interval', 2)
+		self.assertEqual(instance._testrunplan, None)
+
+	def test_day_changed(self):
+		instance = self._generator_._instances['generator0']
+		days = []
+		instance.day_changed = lambda now: days.append(now.day)
+		self._update_values()
+		self.assertEqual(len(days), 1)
+		# Once per day, at midnight
+		midnight = gobject.timer_manager.clock.days.nextmidnight
+		self._update_values(int((midnight - gobject.timer_manager.clock.time()) * 1000) - 1000)
+		self.assertEqual(len(days), 1)
+		self._update_values(1000)
+		self.assertEqual(gobject.timer_manager.clock.time(), midnight)
+		self.assertEqual(days, [days[0], days[0] + 1])
+
+	def test_phase_aggregates(self):
+		# Only the phases of enabled conditions are followed
+		dispatcher = self._generator_._dispatcher
+		self.assertFalse('/Ac/Out/L2/P' in dispatcher._handlers)
+		self._set_setting('/Settings/Generator0/AcLoad/Enabled', 1)
+		self.assertEqual(self._generator_._phasesubscriptions, set(['acout', 'consumption']))
+		self.assertFalse('/Alarms/L1/Overload' in dispatcher._handlers)
+
+		phases = self._generator_._phases.get('com.victronenergy.vebus.ttyO1', 'acout')
+		self.assertEqual((phases.sum, phases.max), (1500, 500))
+		# Kept up to date by the value changes
+		self._monitor.set_value('com.victronenergy.vebus.ttyO1', '/Ac/Out/L2/P', 900)
+		self.assertEqual((phases.sum, phases.max), (1900, 900))
+		self.assertTrue(self._generator_._phases.get('com.victronenergy.vebus.ttyO1', 'acout') is phases)
+		# Read again after the service is removed
+		self._remove_device('com.victronenergy.vebus.ttyO1')
+		self.assertFalse(self._generator_._phases.get('com.victronenergy.vebus.ttyO1', 'acout') is phases)
+		self.assertEqual(self._generator_._phases.get(None, 'acout'), None)
+
+		self._set_setting('/Settings/Generator0/AcLoad/Enabled', 0)
+		self.assertFalse('/Ac/Out/L2/P' in dispatcher._handlers)
+
+	def test_idle_tick(self):
+		self._set_setting('/Settings/Generator0/Soc/Enabled', 1)
+		self._set_setting('/Settings/Generator0/Soc/StartValue', 70)
+		self._set_setting('/Settings/Generator0/Soc/StopValue', 90)
+		self._update_values()
+		# Stopped, nothing counting down
+		self.assertEqual(self._generator_._timerinterval, 10000)
+		self._update_values(30000)
+
+		# Changes nobody handles do not look at the instances
+		calls = []
+		for instance in self._generator_._instances.values():
+			instance.tick_interval = lambda active, f=instance.tick_interval: calls.append(1) or f(active)
+		self._monitor.set_value('com.victronenergy.system', '/Dc/Pv/Power', 100)
+		self.assertEqual(calls, [])
+
+		# A change of a monitored value is evaluated within a second
+		self._monitor.set_value('com.victronenergy.battery.ttyO5', '/Soc', 60)
+		self.assertEqual(self._generator_._timerinterval, 1000)
+		self._update_values()
+		self.assertEqual(self._service['/Generator0/State'], 1)
+		self._update_values(5000)
+		self.assertEqual(self._generator_._timerinterval, 1000)
+
+		# As is a manual start written over dbus
+		self._monitor.set_value('com.victronenergy.battery.ttyO5', '/Soc', 95)
+		self._update_values()
+		self.assertEqual(self._service['/Generator0/State'], 0)
+		self._update_values(5000)
+		self.assertEqual(self._generator_._timerinterval, 10000)
+		self._write('/Generator0/ManualStart', 1)
+		self.assertEqual(self._generator_._timerinterval, 1000)
+		self._update_values()
+		self.assertEqual(self._service['/Generator0/State'], 1)
+		self._update_values()
+
+		# Values written by nobody else are polled within the idle interval
+		self._service['/Generator0/ManualStart'] = 0
+		self._update_values()
+		self.assertEqual(self._service['/Generator0/State'], 0)
+		self._set_setting('/Settings/Generator0/IdleTickInterval', 5)
+		self._update_values()
+		self.assertEqual(self._generator_._timerinterval, 5000)
+		self._service['/Generator0/ManualStart'] = 1
+		self._update_values(4000)
+		self.assertEqual(self._service['/Generator0/State'], 0)
+		self._update_values(1000)
+		self.assertEqual(self._service['/Generator0/State'], 1)
+
+	def test_wakeup_during_tick(self):
+		self._set_setting('/Settings/Generator0/Soc/Enabled', 1)
+		self._set_setting('/Settings/Generator0/Soc/StartValue', 70)
+		self._set_setting('/Settings/Generator0/Soc/StopValue', 90)
+		self._update_values(30000)
+		self.assertEqual(self._generator_._timerinterval, 10000)
+		timers = len(gobject.timer_manager._ids)
+
+		# A change seen while ticking, the tick evaluates it
+		instance = self._generator_._instances.values()[0]
+		tick = instance.tick
+		def changing_tick(snapshot, now):
+			instance.tick = tick
+			self._monitor.set_value('com.victronenergy.battery.ttyO5', '/Soc', 80)
+			tick(snapshot, now)
+		instance.tick = changing_tick
+		self._update_values(10000)
+		self.assertEqual(instance.tick, tick)
+		self.assertEqual(self._generator_._timerinterval, 10000)
+		self.assertEqual(len(gobject.timer_manager._ids), timers)
+
 	def test_skip_testrun(self):
+		starttime = self._seconds_since_midnight()
 		self._set_setting('/Settings/Generator0/TestRun/Enabled', 1)
 		self._set_setting('/Settings/Generator0/TestRun/StartDate', self._today())
-		self._set_setting('/Settings/Generator0/TestRun/StartTime', self._seconds_since_midnight())
+		self._set_setting('/Settings/Generator0/TestRun/StartTime', starttime)
 		self._set_setting('/Settings/Generator0/TestRun/Interval', 4)
 		self._set_setting('/Settings/Generator0/TestRun/Duration', 10)
 		self._set_setting('/Settings/Generator0/TestRun/SkipRuntime', 1)
@@ -595,6 +828,14 @@ class TestGenerator(TestGeneratorBase):
 			'/Generator0/State': States.STOPPED
 		})
 
+		# The next run is shown once the skipped window is over
+		nextrun = time.mktime((self._now().date() + datetime.timedelta(days=4)).timetuple()) + starttime
+		self._update_values(20000)
+		self._check_values({
+			'/Generator0/State': States.STOPPED,
+			'/Generator0/NextTestRun': nextrun
+		})
+
 	def test_testrun_battery_full(self):
 		self._set_setting('/Settings/Generator0/TestRun/Enabled', 1)
 		self._set_setting('/Settings/Generator0/TestRun/StartDate', self._yesterday())
@@ -812,7 +1053,8 @@ class TestGenerator(TestGeneratorBase):
 		})
 
 	def test_minimum_runtime(self):
-		self._set_setting('/Settings/Generator0/MinimumRuntime', 0.010)  # Minutes
+		# Each update is one second later
+		self._set_setting('/Settings/Generator0/MinimumRuntime', 0.025)  # Minutes
 		self._set_setting('/Settings/Generator0/BatteryCurrent/Enabled', 1)
 		self._set_setting('/Settings/Generator0/BatteryCurrent/StartValue', 60)
 		self._set_setting('/Settings/Generator0/BatteryCurrent/StopValue', 30)
@@ -831,12 +1073,191 @@ class TestGenerator(TestGeneratorBase):
 			'/Generator0/State': States.RUNNING
 		})
 
-		sleep(1)
 		self._update_values()
 		self._check_values({
 			'/Generator0/State': States.STOPPED
 		})
 
+	def test_save_runtime_counters(self):
+		instance = self._generator_._instances['generator0']
+		self._service['/Generator0/ManualStart'] = 1
+		self._update_values()
+		self._check_values({
+			'/Generator0/State': States.RUNNING
+		})
+
+		# Runtime is only kept in memory while running
+		self._service['/Generator0/Runtime'] = 100
+		instance._update_accumulated_time()
+		self.assertTrue(instance._counters.dirty)
+		self.assertEqual(self._generator_._settings['accumulatedtotalGenerator0'], 0)
+		self._check_values({
+			'/Generator0/TodayRuntime': 100
+		})
+
+		# And saved when the generator stops
+		self._service['/Generator0/ManualStart'] = 0
+		self._update_values()
+		self._check_values({
+			'/Generator0/State': States.STOPPED
+		})
+		self.assertFalse(instance._counters.dirty)
+		self.assertEqual(self._generator_._settings['accumulatedtotalGenerator0'], 100)
+		self.assertEqual(json.loads(self._generator_._settings['accumulateddailyGenerator0']),
+			{str(self._today()): 100})
+
+	def test_tick_error(self):
+		def publish(now):
+			raise ValueError('publish')
+		self._generator_._instrumentation.publish = publish
+		stderr, sys.stderr = sys.stderr, StringIO.StringIO()
+		try:
+			self.assertRaises(SystemExit, self._generator_._handletimertick)
+		finally:
+			sys.stderr = stderr
+		# Every instance is removed, not only the last one ticked
+		self.assertFalse('/Generator0/State' in self._service)
+		self.assertFalse('/FischerPanda0/State' in self._service)
+
+	def test_replaced_instance_counters(self):
+		self._service['/Generator0/ManualStart'] = 1
+		self._update_values(150000)
+		self.assertEqual(self._service['/Generator0/State'], States.RUNNING)
+		# Saved every AccumulatedSaveInterval only
+		self.assertEqual(self._generator_._settings['accumulatedtotalGenerator0'], 0)
+
+		# The settings service coming back creates the relay instance again
+		self._generator_._device_added('com.victronenergy.settings', 0)
+		# Started on the first tick, a second in
+		self.assertEqual(self._generator_._settings['accumulatedtotalGenerator0'], 149)
+
+	def test_multiple_gensets(self):
+		self._add_device('com.victronenergy.genset.socketcan_can1_di1_uc0',
+			values={
+				'/Start': 0,
+				'/AutoStart': 1,
+				'/Connected': 1,
+				'/ProductId': 0xB040,
+				'/ErrorCode': 0
+			}, instance=1)
+		self._update_values()
+		names = self._generator_._names
+		self.assertEqual(names['com.victronenergy.genset.socketcan_can1_di0_uc0'], 'FischerPanda0')
+		self.assertEqual(names['com.victronenergy.genset.socketcan_can1_di1_uc0'], 'FischerPanda1')
+		settings = self._generator_._instancesettings['FischerPanda1']
+		self.assertEqual(settings.get_short_name('/Settings/FischerPanda1/AcLoad/Enabled'),
+			'acloadenabledFischerPanda1')
+
+		# Each one is evaluated with its own settings and paths
+		self._set_setting('/Settings/FischerPanda0/AcLoad/Enabled', 1)
+		self._set_setting('/Settings/FischerPanda0/AcLoad/Measurement', 1)
+		self._set_setting('/Settings/FischerPanda0/AcLoad/StartValue', 1000)
+		self._set_setting('/Settings/FischerPanda0/AcLoad/StartTimer', 0)
+		self._update_values()
+		self._check_values({
+			'/FischerPanda0/State': States.RUNNING,
+			'/FischerPanda1/State': States.STOPPED
+		})
+
+		# Names stay with the device, a new one does not take the name of a
+		# disconnected one
+		self._monitor.set_value('com.victronenergy.genset.socketcan_can1_di0_uc0', '/Connected', 0)
+		self._update_values()
+		self.assertFalse('com.victronenergy.genset.socketcan_can1_di0_uc0' in names)
+		self._add_device('com.victronenergy.genset.socketcan_can1_di2_uc0',
+			values={
+				'/Start': 0,
+				'/AutoStart': 1,
+				'/Connected': 1,
+				'/ProductId': 0xB040,
+				'/ErrorCode': 0
+			}, instance=2)
+		self.assertEqual(names['com.victronenergy.genset.socketcan_can1_di2_uc0'], 'FischerPanda2')
+		self._monitor.set_value('com.victronenergy.genset.socketcan_can1_di0_uc0', '/Connected', 1)
+		self.assertEqual(names['com.victronenergy.genset.socketcan_can1_di0_uc0'], 'FischerPanda0')
+		self.assertEqual(json.loads(self._generator_._settings['instancenames']), {
+			'genset/0': 'FischerPanda0', 'genset/1': 'FischerPanda1', 'genset/2': 'FischerPanda2'})
+
+		# Found in another order after a restart
+		saved = self._generator_._settings['instancenames']
+		gobject.timer_manager.reset()
+		self._generator_ = MockGenerator()
+		self._monitor = self._generator_._dbusmonitor
+		self._generator_._settings['instancenames'] = saved
+		names = self._generator_._names
+		self._add_device('com.victronenergy.genset.socketcan_can1_di1_uc0',
+			values={
+				'/Start': 0,
+				'/AutoStart': 1,
+				'/Connected': 1,
+				'/ProductId': 0xB040,
+				'/ErrorCode': 0
+			}, instance=1)
+		self.assertEqual(names['com.victronenergy.genset.socketcan_can1_di1_uc0'], 'FischerPanda1')
+
+	def test_service_index(self):
+		index = self._generator_._serviceindex
+		self.assertEqual(index.get('battery', 258), 'com.victronenergy.battery.ttyO5')
+		self.assertEqual(index.get('vebus', 251), 'com.victronenergy.vebus.ttyO1')
+		self.assertEqual(index.get('vebus', 258), None)
+		self._remove_device('com.victronenergy.battery.ttyO5')
+		self.assertEqual(index.get('battery', 258), None)
+
+	def test_injected_clock(self):
+		now = [1000.0]
+		self._generator_._clock.monotonic = lambda: now[0]
+		self._service['/Generator0/ManualStart'] = 1
+		self._update_values()
+		self._check_values({
+			'/Generator0/State': States.RUNNING,
+			'/Generator0/Runtime': 0
+		})
+
+		now[0] += 120
+		self._update_values()
+		self._check_values({
+			'/Generator0/Runtime': 120
+		})
+
+	def test_recording(self):
+		path = tempfile.mktemp()
+		self.addCleanup(os.remove, path)
+		self._generator_.start_recording(recorder.Recorder(path))
+		self._set_setting('/Settings/Generator0/Soc/Enabled', 1)
+		self._monitor.set_value('com.victronenergy.battery.ttyO5', '/Soc', 55)
+		self._remove_device('com.victronenergy.battery.ttyO5')
+		self._generator_._recorder.close()
+
+		records = list(recorder.read(path))
+		# The current values come first
+		self.assertTrue([records[0][0], 'com.victronenergy.battery.ttyO5', '/Soc', 87] in
+			[list(r) for r in records])
+		self.assertEqual([r[1:] for r in records[-3:]], [
+			('com.victronenergy.settings', '/Settings/Generator0/Soc/Enabled', 1),
+			('com.victronenergy.battery.ttyO5', '/Soc', 55),
+			('com.victronenergy.battery.ttyO5', None, None)])
+
+	def test_instrumentation(self):
+		self._generator_._instrumentation.PUBLISH_INTERVAL = 0
+		self._set_setting('/Settings/Generator0/IdleTickInterval', 1)
+		self._set_setting('/Settings/Generator0/Soc/Enabled', 1)
+		self._update_values()
+		self._monitor.set_value('com.victronenergy.battery.ttyO5', '/Soc', 86)
+		self._update_values()
+		# Nothing changed
+		self._update_values()
+
+		self.assertTrue(self._service['/Debug/Tick/Count'] >= 3)
+		self.assertTrue(self._service['/Debug/Tick/P50'] <= self._service['/Debug/Tick/P95']
+						<= self._service['/Debug/Tick/Max'])
+		self.assertEqual(self._service['/Debug/Generator0/ValueChanges'], 1)
+		self.assertTrue(self._service['/Debug/Generator0/Evaluations'] >= 1)
+		self.assertTrue(self._service['/Debug/Generator0/SkippedEvaluations'] >= 1)
+
+		# Removed with the instance
+		self._monitor.set_value('com.victronenergy.settings', '/Settings/Relay/Function', 0)
+		self.assertFalse('/Debug/Generator0/Evaluations' in self._service)
+
 	def test_timed_condition(self):
 		self._set_setting('/Settings/Generator0/MinimumRuntime', 0.010)  # Minutes
 		self._set_setting('/Settings/Generator0/BatteryCurrent/Enabled', 1)
@@ -851,8 +1272,6 @@ class TestGenerator(TestGeneratorBase):
 			'/Generator0/State': States.STOPPED
 		})
 
-		sleep(1)
-
 		self._update_values()
 		self._check_values({
 			'/Generator0/State': States.RUNNING
@@ -865,7 +1284,6 @@ class TestGenerator(TestGeneratorBase):
 			'/Generator0/State': States.RUNNING
 		})
 
-		sleep(1)
 		self._update_values()
 		self._check_values({
 			'/Generator0/State': States.STOPPED
@@ -880,8 +1298,9 @@ class TestGenerator(TestGeneratorBase):
 		self._set_setting('/Settings/Generator0/BatteryCurrent/StartTimer', 0)
 		self._set_setting('/Settings/Generator0/BatteryCurrent/StopTimer', 0)
 		self._set_setting('/Settings/Generator0/QuietHours/Enabled', 1)
-		self._set_setting('/Settings/Generator0/QuietHours/StartTime', self._seconds_since_midnight() + 1)
-		self._set_setting('/Settings/Generator0/QuietHours/EndTime', self._seconds_since_midnight() + 2)
+		# The next update is one second later
+		self._set_setting('/Settings/Generator0/QuietHours/StartTime', self._seconds_since_midnight() + 2)
+		self._set_setting('/Settings/Generator0/QuietHours/EndTime', self._seconds_since_midnight() + 3)
 
 		self._monitor.set_value('com.victronenergy.battery.ttyO5', '/Dc/0/Current', -60)
 
@@ -901,6 +1320,145 @@ class TestGenerator(TestGeneratorBase):
 			'/Generator0/State': States.RUNNING
 		})
 
+	def test_quiethours_schedule(self):
+		instance = self._generator_._instances['generator0']
+		self._set_setting('/Settings/Generator0/QuietHours/Enabled', 1)
+		self._set_setting('/Settings/Generator0/QuietHours/StartTime', self._seconds_since_midnight() + 5)
+		self._set_setting('/Settings/Generator0/QuietHours/EndTime', self._seconds_since_midnight() + 10)
+		start = gobject.timer_manager.clock.time() + 5
+
+		self._update_values()
+		self._check_values({
+			'/Generator0/QuietHours': 0
+		})
+		# Not computed again till the start
+		self.assertEqual(instance._quiethoursuntil, start)
+		instance._quiethoursactive = None
+		self._update_values(3000)
+		self.assertEqual(instance._quiethoursactive, None)
+
+		# Without any input changing
+		self._update_values(1000)
+		self._check_values({
+			'/Generator0/QuietHours': 1
+		})
+		self._update_values(5000)
+		self._check_values({
+			'/Generator0/QuietHours': 0
+		})
+		# Till midnight
+		self.assertEqual(instance._quiethoursuntil,
+			time.mktime((self._now().date() + datetime.timedelta(days=1)).timetuple()))
+
+		# A setting change computes it again
+		self._set_setting('/Settings/Generator0/QuietHours/EndTime', self._seconds_since_midnight() + 100)
+		self._update_values()
+		self._check_values({
+			'/Generator0/QuietHours': 1
+		})
+
+	def test_quiethours_overnight_end(self):
+		instance = self._generator_._instances['generator0']
+		# Started yesterday evening, ends in 5 seconds
+		self._set_setting('/Settings/Generator0/QuietHours/Enabled', 1)
+		self._set_setting('/Settings/Generator0/QuietHours/StartTime', self._seconds_since_midnight() + 7200)
+		self._set_setting('/Settings/Generator0/QuietHours/EndTime', self._seconds_since_midnight() + 5)
+		end = gobject.timer_manager.clock.time() + 5
+		self._update_values()
+		self._check_values({
+			'/Generator0/QuietHours': 1
+		})
+		self.assertEqual(instance._quiethoursuntil, end)
+
+		# Evaluated at the end time, the end is not part of the quiet hours
+		self._update_values(4000)
+		self.assertEqual(gobject.timer_manager.clock.time(), end)
+		self._check_values({
+			'/Generator0/QuietHours': 0
+		})
+		self.assertEqual(instance._quiethoursuntil, end + 7195)
+		self._update_values(10000)
+		self._check_values({
+			'/Generator0/QuietHours': 0
+		})
+		self._update_values(3600000)
+		self._check_values({
+			'/Generator0/QuietHours': 0
+		})
+
+	def test_evaluate_on_change(self):
+		self._set_setting('/Settings/Generator0/BatteryCurrent/Enabled', 1)
+		self._set_setting('/Settings/Generator0/BatteryCurrent/StartValue', 60)
+		self._set_setting('/Settings/Generator0/BatteryCurrent/StopValue', 30)
+		self._set_setting('/Settings/Generator0/BatteryCurrent/StartTimer', 0)
+		self._set_setting('/Settings/Generator0/BatteryCurrent/StopTimer', 0)
+		self._update_values()
+
+		instance = self._generator_._instances['generator0']
+		evaluations = []
+		evaluate = instance._evaluate_startstop_conditions
+		def count(*args):
+			evaluations.append(1)
+			evaluate(*args)
+		instance._evaluate_startstop_conditions = count
+
+		# Nothing changed, no evaluation needed
+		self._update_values(5000)
+		self.assertEqual(len(evaluations), 0)
+
+		# Changes on a service that is not in use are ignored
+		self._add_device('com.victronenergy.battery.ttyO6',
+			product_name='battery',
+			instance=259,
+			values={
+				'/Dc/0/Voltage': 12.4,
+				'/Dc/0/Current': 10,
+				'/Soc': 50
+				})
+		self._update_values()
+		evaluations[:] = []
+		self._monitor.set_value('com.victronenergy.battery.ttyO6', '/Dc/0/Current', -60)
+		self._update_values()
+		self.assertEqual(len(evaluations), 0)
+
+		self._monitor.set_value('com.victronenergy.battery.ttyO5', '/Dc/0/Current', -60)
+		self._update_values()
+		self.assertEqual(len(evaluations), 1)
+		self._check_values({
+			'/Generator0/State': States.RUNNING
+		})
+
+		# Running generator is evaluated each tick
+		self._update_values(5000)
+		self.assertEqual(len(evaluations), 6)
+
+	def test_subscribed_inputs(self):
+		self._set_setting('/Settings/Generator0/Soc/Enabled', 1)
+		self._update_values()
+
+		instance = self._generator_._instances['generator0']
+		evaluations = []
+		evaluate = instance._evaluate_startstop_conditions
+		def count(*args):
+			evaluations.append(1)
+			evaluate(*args)
+		instance._evaluate_startstop_conditions = count
+
+		# AC load is not monitored while its condition is disabled
+		self._monitor.set_value('com.victronenergy.vebus.ttyO1', '/Ac/Out/L1/P', 2000)
+		self._update_values()
+		self.assertEqual(len(evaluations), 0)
+		self._monitor.set_value('com.victronenergy.battery.ttyO5', '/Soc', 70)
+		self._update_values()
+		self.assertEqual(len(evaluations), 1)
+
+		self._set_setting('/Settings/Generator0/AcLoad/Enabled', 1)
+		self._update_values()
+		evaluations[:] = []
+		self._monitor.set_value('com.victronenergy.vebus.ttyO1', '/Ac/Out/L1/P', 500)
+		self._update_values()
+		self.assertEqual(len(evaluations), 1)
+
 	def test_condition_cascade(self):
 		self._set_setting('/Settings/Generator0/AcLoad/Enabled', 1)
 		self._set_setting('/Settings/Generator0/AcLoad/Measurement', 1)
@@ -966,6 +1524,295 @@ class TestGenerator(TestGeneratorBase):
 			'/Generator0/State': States.STOPPED
 		})
 
+	def test_shared_snapshot(self):
+		self._set_setting('/Settings/FischerPanda0/Soc/Enabled', 1)
+		self._set_setting('/Settings/Generator0/Soc/Enabled', 1)
+		reads = []
+		get_value = self._monitor.get_value
+		def counted_get_value(service, path):
+			reads.append((service, path))
+			return get_value(service, path)
+		self._monitor.get_value = counted_get_value
+
+		self._update_values()
+		self._check_values({
+			'/Generator0/State': States.STOPPED,
+			'/FischerPanda0/State': States.STOPPED
+		})
+		# Both instances evaluated, each input read only once
+		self.assertTrue(('com.victronenergy.battery.ttyO5', '/Soc') in reads)
+		self.assertEqual(len(reads), len(set(reads)))
+
+
+class TestDeadlineScheduler(unittest.TestCase):
+	def setUp(self):
+		self._now = 0
+		self._fired = []
+		self._scheduler = DeadlineScheduler(lambda: self._now)
+
+	def _fire(self, name):
+		self._fired.append((self._now, name))
+
+	def test_order(self):
+		self._scheduler.schedule('b', 20, self._fire, 'b')
+		self._scheduler.schedule('a', 10, self._fire, 'a')
+		self._scheduler.schedule('c', 30, self._fire, 'c')
+		self.assertEqual(self._scheduler.next_deadline(), 10)
+		self._now = 25
+		self._scheduler.run()
+		self.assertEqual(self._fired, [(25, 'a'), (25, 'b')])
+		self.assertEqual(self._scheduler.remaining('c'), 5)
+
+	def test_cancel_and_reschedule(self):
+		self._scheduler.schedule('a', 10, self._fire, 'a')
+		self._scheduler.schedule('b', 20, self._fire, 'b')
+		self._scheduler.cancel('a')
+		self.assertFalse(self._scheduler.pending('a'))
+		self.assertEqual(self._scheduler.next_deadline(), 20)
+		self._now = 5
+		# Counts from the moment it was scheduled
+		self._scheduler.reschedule('b', 8)
+		self.assertEqual(self._scheduler.next_deadline(), 8)
+		self._now = 10
+		self._scheduler.run()
+		self.assertEqual(self._fired, [(10, 'b')])
+		self.assertEqual(self._scheduler.next_deadline(), None)
+
+
+class TestRuntimeHistory(unittest.TestCase):
+	def test_interval_runtime(self):
+		history = RuntimeHistory(30)
+		history.load(100, json.dumps({str(98 * 86400): 300, str(99 * 86400): 600}))
+		history.add(100, 60)
+		self.assertEqual(history.runtime(100), 60)
+		self.assertEqual(history.runtime(100, 1), 660)
+		self.assertEqual(history.runtime(100, 2), 960)
+		# Two days later, nothing run since
+		self.assertEqual(history.runtime(102), 0)
+		self.assertEqual(history.runtime(102, 3), 660)
+		self.assertEqual(history.runtime(102, 4), 960)
+		history.add(102, 30)
+		self.assertEqual(history.runtime(102, 2), 90)
+
+	def test_history_length(self):
+		history = RuntimeHistory(30)
+		history.load(100, '')
+		for day in range(100, 140):
+			history.add(day, 10)
+		self.assertEqual(history.runtime(139, 365), 300)
+		self.assertEqual(len(json.loads(history.dumps())), 30)
+		self.assertEqual(json.loads(history.dumps())[str(139 * 86400)], 10)
+
+	def test_dumps(self):
+		history = RuntimeHistory(30)
+		daily = {str(98 * 86400): 300, str(100 * 86400): 20}
+		history.load(100, json.dumps(daily))
+		self.assertEqual(json.loads(history.dumps()), daily)
+
+
+class TestDBusServicePrefix(unittest.TestCase):
+	def test_batch(self):
+		writes = []
+		class Service(dict):
+			def __setitem__(self, path, value):
+				writes.append(path)
+				dict.__setitem__(self, path, value)
+		service = Service({'/Generator0/State': 0, '/Generator0/Runtime': 0})
+		paths = DBusServicePrefix(service, 'Generator0')
+
+		paths.begin()
+		paths['/State'] = 1
+		paths['/State'] = 0
+		paths['/Runtime'] = 10
+		paths['/Runtime'] = 20
+		self.assertEqual(paths['/Runtime'], 20)
+		self.assertEqual(writes, [])
+		paths.commit()
+		# State did not change at the end
+		self.assertEqual(writes, ['/Generator0/Runtime'])
+		self.assertEqual(service['/Generator0/Runtime'], 20)
+
+		# Written straight away outside a batch
+		paths['/State'] = 1
+		self.assertEqual(service['/Generator0/State'], 1)
+
+
+class TestConditions(unittest.TestCase):
+	def test_registry(self):
+		self.assertEqual([cls.name for cls in conditions.registry],
+			['soc', 'acload', 'batterycurrent', 'batteryvoltage', 'inverterhightemp',
+			'inverteroverload', 'stoponac1'])
+		self.assertEqual(conditions.get_inputs('system'), conditions.consumption_paths)
+		self.assertTrue('acloadmeasuerment' in conditions.get_settingsbase())
+		# Slotted, no per object dict
+		self.assertFalse(hasattr(conditions.SocCondition(), '__dict__'))
+
+
+class TestPhaseValues(unittest.TestCase):
+	def test_aggregates(self):
+		phases = PhaseValues([None, None, None])
+		self.assertEqual((phases.sum, phases.max), (0, None))
+		# Same results as summing and comparing all the phases
+		for phase, value in [(0, 500), (1, 700), (2, 300), (1, None), (0, 200),
+							(2, 0), (0, None), (2, None), (1, 100)]:
+			phases.set(phase, value)
+			self.assertEqual(phases.sum, sum(filter(None, phases.values)))
+			self.assertEqual(phases.max, max(phases.values))
+
+		# Float values leave no rounding error in the sum
+		phases.set(0, 0.1)
+		phases.set(1, 0.2)
+		phases.set(0, None)
+		phases.set(1, None)
+		self.assertEqual(phases.sum, 0)
+
+
+class TestRecorder(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.dir)
+		self.path = os.path.join(self.dir, 'recording')
+
+	def test_values(self):
+		r = recorder.Recorder(self.path)
+		values = [None, 1, -2 ** 40, 2.5, 'abc', u'\xe9', 'abc', [1, 2]]
+		for i, value in enumerate(values):
+			r.record(100.0 + i, 'com.victronenergy.battery.ttyO5', '/Soc', value)
+		r.removed(200.0, 'com.victronenergy.battery.ttyO5')
+		r.close()
+		records = list(recorder.read(self.path))
+		self.assertEqual([v for t, s, p, v in records[:-1]], values)
+		self.assertEqual(records[1], (101.0, 'com.victronenergy.battery.ttyO5', '/Soc', 1))
+		self.assertEqual(records[-1], (200.0, 'com.victronenergy.battery.ttyO5', None, None))
+
+		# A record cut short ends the recording
+		with open(self.path, 'r+b') as f:
+			f.truncate(os.path.getsize(self.path) - 3)
+		self.assertEqual(len(list(recorder.read(self.path))), len(values))
+
+	def test_reopen(self):
+		r = recorder.Recorder(self.path)
+		r.record(100.0, 'com.victronenergy.battery.ttyO5', '/Soc', 85)
+		r.close()
+		# A restarted recorder keeps the previous recording apart
+		r = recorder.Recorder(self.path)
+		r.record(200.0, 'com.victronenergy.system', '/Ac/Consumption/L1/Power', 700)
+		r.close()
+		self.assertEqual(list(recorder.read(self.path + '.1')),
+			[(100.0, 'com.victronenergy.battery.ttyO5', '/Soc', 85)])
+		self.assertEqual(list(recorder.read(self.path)),
+			[(200.0, 'com.victronenergy.system', '/Ac/Consumption/L1/Power', 700)])
+
+	def test_rotation(self):
+		r = recorder.Recorder(self.path, maxsize=1000, count=2)
+		for i in range(200):
+			r.record(float(i), 'com.victronenergy.system', '/Ac/Consumption/L1/Power', i)
+		r.close()
+		self.assertEqual(sorted(os.listdir(self.dir)), ['recording', 'recording.1', 'recording.2'])
+		# Every file can be read alone, the last one ends with the last record
+		previous = list(recorder.read(self.path + '.1'))
+		last = list(recorder.read(self.path))
+		self.assertEqual(previous[-1][3] + 1, last[0][3])
+		self.assertEqual(last[-1], (199.0, 'com.victronenergy.system', '/Ac/Consumption/L1/Power', 199))
+
+
+class TestTimingStats(unittest.TestCase):
+	def test_percentiles(self):
+		stats = TimingStats()
+		self.assertEqual(stats.percentile(50), None)
+		for i in range(90):
+			stats.add(0.0001)
+		for i in range(10):
+			stats.add(0.05)
+		# Bucket upper bounds, 128 us and 65.536 ms limited by the max
+		self.assertEqual(stats.percentile(50), 0.000128)
+		self.assertEqual(stats.percentile(95), 0.05)
+		self.assertEqual(stats.max, 0.05)
+		# Wall clock steps are left out
+		stats.add(-1)
+		stats.add(7200)
+		self.assertEqual(stats.count, 100)
+
+
+class TestClockReading(unittest.TestCase):
+	def test_reading(self):
+		clock = VirtualClock(gobject.EPOCH)
+		clock.advance(90)
+		now = clock.read()
+		self.assertEqual(now.time, gobject.EPOCH + 90)
+		self.assertEqual(now.monotonic, 90)
+		self.assertEqual(now.today, datetime.date.fromtimestamp(now.time))
+		self.assertEqual(datetime.datetime.fromtimestamp(now.midnight),
+			datetime.datetime.combine(now.today, datetime.time(0)))
+		self.assertEqual(now.day * 86400, calendar.timegm(now.today.timetuple()))
+		self.assertEqual(now.seconds_since_midnight, now.time - now.midnight)
+		tomorrow = now.today + datetime.timedelta(days=1)
+		self.assertEqual(datetime.datetime.fromtimestamp(now.local_midnight(tomorrow)),
+			datetime.datetime.combine(tomorrow, datetime.time(0)))
+		self.assertEqual(now.nextmidnight, now.local_midnight(tomorrow))
+		# A reading does not move with the clock
+		clock.advance(10)
+		self.assertEqual(now.time, gobject.EPOCH + 90)
+
+	def test_local_days(self):
+		clock = VirtualClock(gobject.EPOCH)
+		now = clock.read()
+		# Kept till midnight
+		clock.days.today = None
+		clock.set_time(now.nextmidnight - 1)
+		self.assertEqual(clock.read().today, None)
+		clock.set_time(now.nextmidnight)
+		tomorrow = clock.read()
+		self.assertEqual(tomorrow.day, now.day + 1)
+		self.assertEqual(tomorrow.midnight, now.nextmidnight)
+
+	def test_local_zone(self):
+		zone = LocalZone()
+		tz = os.environ.get('TZ')
+		try:
+			zone.set('Europe/Amsterdam')
+			# DST starts 2017-03-26 at 01:00 UTC
+			transition = 1490490000
+			self.assertEqual(zone.utcoffset(transition - 86400), 3600)
+			self.assertEqual(zone.validuntil, transition)
+			self.assertEqual(zone.utcoffset(transition), 7200)
+			self.assertEqual(zone.validfrom, transition)
+			# A 23 hour day
+			day = zone.day(transition)
+			self.assertEqual(datetime.date.fromordinal(719163 + day), datetime.date(2017, 3, 26))
+			self.assertEqual(zone.midnight(day + 1) - zone.midnight(day), 23 * 3600)
+			self.assertEqual(zone.midnight(day), time.mktime((2017, 3, 26, 0, 0, 0, 0, 0, -1)))
+			# Cached till the next transition, in october
+			self.assertEqual(zone.validuntil, 1509238800)
+		finally:
+			if tz is None:
+				del os.environ['TZ']
+			else:
+				os.environ['TZ'] = tz
+			time.tzset()
+
+
+class TestReplay(unittest.TestCase):
+	def test_replay(self):
+		trace = [
+			[1500000000, 'com.victronenergy.settings', '/Settings/Relay/Function', 1],
+			[1500000000, 'com.victronenergy.settings', '/Settings/Services/FischerPandaAutoStartStop', 0],
+			[1500000000, 'com.victronenergy.system', '/AutoSelectedBatteryMeasurement', 'com_victronenergy_battery_258/Dc/0'],
+			[1500000000, 'com.victronenergy.system', '/Relay/0/State', 0],
+			[1500000000, 'com.victronenergy.battery.ttyO5', '/DeviceInstance', 258],
+			[1500000000, 'com.victronenergy.battery.ttyO5', '/Soc', 85],
+			[1500000100, 'com.victronenergy.battery.ttyO5', '/Soc', 75],
+			[1500000400, 'com.victronenergy.battery.ttyO5', '/Soc', 95],
+			[1500001000, 'com.victronenergy.battery.ttyO5', None, None]]
+		out = StringIO.StringIO()
+		r = replay.Replay(replay.read_trace([json.dumps(record) for record in trace]),
+			[('/Settings/Generator0/Soc/Enabled', 1)], out)
+		r.run()
+		# Ticks every 10 s while stopped and every second while running
+		self.assertEqual(r.ticks, 370)
+		self.assertEqual(r.starts, {'Generator0': 1})
+		self.assertEqual(r.runtime, {'Generator0': 300})
+
 
 if __name__ == '__main__':
 	unittest.main()
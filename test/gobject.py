@@ -1,3 +1,11 @@
+import heapq
+from clock import VirtualClock
+
+# Wall time of the start of the virtual time, 2017-07-14 12:00 UTC, away from
+# midnight in any timezone a test might run in
+EPOCH = 1500033600
+
+
 class MockTimer(object):
 	def __init__(self, start, timeout, callback, *args, **kwargs):
 		self._timeout = timeout
@@ -5,6 +13,7 @@ class MockTimer(object):
 		self._callback = callback
 		self._args = args
 		self._kwargs = kwargs
+		self.removed = False
 
 	def run(self):
 		self._next += self._timeout
@@ -16,12 +25,26 @@ class MockTimer(object):
 
 
 class MockTimerManager(object):
+	""" Runs the timers in virtual time, nothing waits. The timers are kept
+	in a heap ordered by expiry and then by creation, so timers expiring at
+	the same time run in the order they were added. The clock follows the
+	virtual time, starting at EPOCH. """
 	def __init__(self):
-		self._timers = []
-		self._time = 0
+		self.reset()
 
 	def add_timer(self, timeout, callback, *args, **kwargs):
-		self._timers.append(MockTimer(self._time, timeout, callback, *args, **kwargs))
+		self._seq += 1
+		timer = MockTimer(self._time, timeout, callback, *args, **kwargs)
+		heapq.heappush(self._timers, (timer.next, self._seq, timer))
+		self._ids[self._seq] = timer
+		return self._seq
+
+	def remove_timer(self, id):
+		# Dropped when it reaches the top
+		timer = self._ids.pop(id, None)
+		if timer is not None:
+			timer.removed = True
+		return timer is not None
 
 	def add_idle(self, callback, *args, **kwargs):
 		self.add_timer(self._time, callback, *args, **kwargs)
@@ -38,23 +61,31 @@ class MockTimerManager(object):
 
 	def start(self):
 		try:
-			while True:
-				next_timer = None
-				for t in self._timers:
-					if next_timer == None or t.next < next_timer.next:
-						next_timer = t
-				if next_timer == None:
-					return
-				self._time = next_timer.next
-				if not next_timer.run():
-					self._timers.remove(next_timer)
+			while self._timers:
+				# Timers added while running expire later or were added later,
+				# so the one running stays on top
+				t, seq, timer = self._timers[0]
+				if timer.removed:
+					heapq.heappop(self._timers)
+					continue
+				self._time = t
+				self.clock.set_time(EPOCH + t / 1000.0)
+				if timer.run():
+					heapq.heapreplace(self._timers, (timer.next, seq, timer))
+				else:
+					heapq.heappop(self._timers)
+					self._ids.pop(seq, None)
 		except StopIteration:
-			self._timers.remove(next_timer)
-			pass
+			t, seq, timer = heapq.heappop(self._timers)
+			self._ids.pop(seq, None)
 
 	def reset(self):
 		self._timers = []
+		self._ids = {}
+		self._seq = 0
 		self._time = 0
+		# A new clock, tests may replace its methods
+		self.clock = VirtualClock(EPOCH)
 
 
 timer_manager = MockTimerManager()
@@ -65,11 +96,15 @@ def idle_add(callback, *args, **kwargs):
 
 
 def timeout_add(timeout, callback, *args, **kwargs):
-	timer_manager.add_timer(timeout, callback, *args, **kwargs)
+	return timer_manager.add_timer(timeout, callback, *args, **kwargs)
+
+
+def source_remove(id):
+	return timer_manager.remove_timer(id)
 
 
 def timeout_add_seconds(timeout, callback, *args, **kwargs):
-	timeout_add(timeout * 1000, callback, *args, **kwargs)
+	return timeout_add(timeout * 1000, callback, *args, **kwargs)
 
 
 def test_function(m, name):